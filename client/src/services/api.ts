@@ -3,6 +3,20 @@ import { API_CONFIG, getApiUrl } from '../config/api';
 
 class ApiService {
   private isServerAvailable = false;
+
+  // Учётные данные для сервера: подписанный initData WebApp, а вне Telegram (разработка) — сохранённый пользователь
+  private authHeaders(): Record<string, string> {
+    const headers: Record<string, string> = {};
+    const initData = window.Telegram?.WebApp?.initData;
+    if (initData) {
+      headers['X-Telegram-Init-Data'] = initData;
+    }
+    const storedUser = localStorage.getItem('telegram_user');
+    if (storedUser) {
+      headers['X-Telegram-User'] = btoa(unescape(encodeURIComponent(storedUser)));
+    }
+    return headers;
+  }
   
   async checkServerConnection(): Promise<boolean> {
     try {
@@ -91,13 +105,14 @@ class ApiService {
     const timeoutId = setTimeout(() => controller.abort(), 60000);
     
     const config: RequestInit = {
+      ...options,
       signal: controller.signal,
       headers: {
         'Accept': 'application/json',
         // Не устанавливаем Content-Type для FormData - браузер сам установит с boundary
-        ...options.headers,
+        ...(typeof options.headers === 'object' ? options.headers : {}),
+        ...this.authHeaders(),
       },
-      ...options,
     };
 
     telegramLogger.info(`🚀 ${options.method || 'GET'} ${url} (FormData)`);
@@ -154,15 +169,15 @@ class ApiService {
     const timeoutId = setTimeout(() => controller.abort(), API_CONFIG.TIMEOUT);
     
     const config: RequestInit = {
+      ...options,
       signal: controller.signal,
       headers: {
         'Accept': 'application/json',
         'Content-Type': 'application/json',
-        // Подставляем заголовок с данными пользователя, если он сохранен локально
         ...(typeof options.headers === 'object' ? options.headers : {}),
-        ...(localStorage.getItem('telegram_user') ? { 'x-telegram-user': btoa(unescape(encodeURIComponent(localStorage.getItem('telegram_user') || ''))) } : {})
+        // Учётные данные пользователя: options.headers не должны их затирать
+        ...this.authHeaders(),
       },
-      ...options,
     };
 
     telegramLogger.info(`🚀 ${options.method || 'GET'} ${url}`);
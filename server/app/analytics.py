@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from .indexes import OrderIndexBase
+from .utils import TimeUtils
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# Допустимые измерения группировки и их имена в ответе
+GROUP_FIELDS = {"day": "day", "status": "status", "employee": "createdBy"}
+
+
+class OrderStats(OrderIndexBase):
+    """Материализованные счётчики заказов по (serviceId, day, status, created_by_id)"""
+
+    def __init__(self):
+        super().__init__()
+        # serviceId -> день (номер дня от эпохи) -> Counter[(status, created_by_id)]
+        self._counters: Dict[Optional[int], Dict[int, Counter]] = {}
+        # serviceId -> отсортированные дни, в которых есть заказы
+        self._days: Dict[Optional[int], List[int]] = {}
+        # id заказа -> учтённый слот: удаление по id, а не по документу, который передал вызывающий
+        self._slots: Dict[int, Tuple[Optional[int], int, Tuple[str, Optional[int]]]] = {}
+
+    @staticmethod
+    def _slot(doc: Dict[str, Any]) -> Tuple[Optional[int], int, Tuple[str, Optional[int]]]:
+        day = (doc.get("created_at") or 0) // DAY_MS
+        return doc.get("serviceId"), day, (doc.get("status", "active"), doc.get("created_by_id"))
+
+    def add(self, doc: Dict[str, Any]):
+        if doc["id"] in self._slots:
+            self.remove(doc)
+        service_id, day, key = self._slots[doc["id"]] = self._slot(doc)
+        days = self._counters.setdefault(service_id, {})
+        if day not in days:
+            days[day] = Counter()
+            insort(self._days.setdefault(service_id, []), day)
+        days[day][key] += 1
+
+    def remove(self, doc: Dict[str, Any]):
+        slot = self._slots.pop(doc["id"], None)
+        if slot is None:
+            return
+        service_id, day, key = slot
+        counter = self._counters[service_id][day]
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+        if not counter:
+            del self._counters[service_id][day]
+            service_days = self._days[service_id]
+            del service_days[bisect_left(service_days, day)]
+
+    def query(
+        self,
+        service_id: int,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        group_by: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """Агрегаты за период [from_ms, to_ms] по выбранным измерениям"""
+        group_by = group_by or ["day"]
+        days = self._days.get(service_id, [])
+        lo = bisect_left(days, from_ms // DAY_MS) if from_ms is not None else 0
+        hi = bisect_right(days, to_ms // DAY_MS) if to_ms is not None else len(days)
+
+        groups: Counter = Counter()
+        total = 0
+        for day in days[lo:hi]:
+            for (status, created_by), count in self._counters[service_id][day].items():
+                values = {"day": day, "status": status, "employee": created_by}
+                groups[tuple(values[field] for field in group_by)] += count
+                total += count
+
+        rows = []
+        for key, count in sorted(groups.items(), key=lambda item: tuple((v is None, v or 0) for v in item[0])):
+            row = {}
+            for field, value in zip(group_by, key):
+                row[GROUP_FIELDS[field]] = TimeUtils.to_iso(value * DAY_MS)[:10] if field == "day" else value
+            row["count"] = count
+            rows.append(row)
+        return {"serviceId": service_id, "groupBy": group_by, "total": total, "groups": rows}
+
+
+# Глобальный экземпляр аналитики заказов
+order_stats = OrderStats()
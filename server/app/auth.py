@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from .settings import settings
+from .storage import db
+from .utils import LoggerUtils, TimeUtils
+
+
+def verify_init_data(init_data: str, bot_token: str, max_age_s: int) -> Tuple[Dict[str, Any], int]:
+    """Проверка подписи Telegram WebApp initData; возвращает (user, auth_date в epoch-ms)"""
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received_hash = fields.pop("hash", None)
+    if not received_hash:
+        raise ValueError("В initData нет подписи")
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        raise ValueError("Неверная подпись initData")
+
+    auth_date_ms = int(fields.get("auth_date", 0)) * 1000
+    if TimeUtils.now_ms() - auth_date_ms > max_age_s * 1000:
+        raise ValueError("initData устарели")
+    user = json.loads(fields.get("user") or "{}")
+    if not user.get("id"):
+        raise ValueError("В initData нет пользователя")
+    return user, auth_date_ms
+
+
+class IdentityCache:
+    """Проверенные учётные данные -> id пользователя до истечения срока; подпись проверяется один раз"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # sha256(учётные данные) -> (user_id, истекает в epoch-ms)
+        self._entries: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+        # user_id -> (версия документа users, User) — профиль перечитывается только после записи в него
+        self._users: Dict[int, Tuple[int, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(credentials: str) -> str:
+        return hashlib.sha256(credentials.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[int]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= TimeUtils.now_ms():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: str, user_id: int, expires_at: int):
+        self._entries[key] = (user_id, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def cached_user(self, user_id: int) -> Optional[Any]:
+        """Профиль из кеша, если документ пользователя не менялся с момента загрузки"""
+        entry = self._users.get(user_id)
+        if entry and entry[0] == db.version("users", user_id):
+            return entry[1]
+        return None
+
+    def remember_user(self, user: Any, version: int):
+        self._users[user.id] = (version, user)
+        if len(self._users) > self.max_entries:
+            self._users.pop(next(iter(self._users)))
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "users": len(self._users), "hits": self.hits, "misses": self.misses}
+
+
+class LastSeenBuffer:
+    """Отметки lastSeen копятся в памяти и пишутся в users одной записью раз в интервал"""
+
+    def __init__(self):
+        self._pending: Dict[int, int] = {}
+        self.flushed = 0
+
+    def touch(self, user_id: int):
+        self._pending[user_id] = TimeUtils.now_ms()
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+
+        def apply(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            seen = pending.get(doc.get("id"))
+            if seen is None or (doc.get("lastSeen") or 0) >= seen:
+                return None
+            return {"lastSeen": seen}
+
+        updated = await db.transform("users", apply)
+        self.flushed += updated
+        return updated
+
+    async def run_flush_loop(self, interval_s: int):
+        """Периодическая запись накопленных lastSeen"""
+        while True:
+            await asyncio.sleep(interval_s)
+            try:
+                await self.flush()
+            except Exception as e:
+                LoggerUtils.log_error("Ошибка записи lastSeen", e)
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self._pending), "flushed": self.flushed}
+
+
+# Глобальные кеш аутентификации и буфер lastSeen
+identity_cache = IdentityCache(settings.auth_cache_size)
+last_seen = LastSeenBuffer()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+from starlette.middleware.exceptions import ExceptionMiddleware
+from starlette.types import ASGIApp, Message, Scope
+
+from .models import BatchSubRequest
+from .responses import dumps
+from .utils import LoggerUtils
+
+# Заголовки исходного запроса, которые не переносятся в подзапросы: тело у каждого своё,
+# ответ подзапроса не сжимается, профилирование и трассировка относятся ко всему пакету
+_SKIP_HEADERS = {b"content-length", b"content-type", b"accept-encoding", b"x-profile", b"x-trace"}
+# Заголовки ответа, которые не нужны в JSON пакета
+_SKIP_RESPONSE_HEADERS = {"content-length", "content-type", "content-encoding", "vary"}
+
+
+class BatchDispatcher:
+    """Выполнение подзапросов пакета в процессе, через роутер приложения без сетевого round-trip"""
+
+    def __init__(self, app, max_requests: int, timeout_s: float):
+        self.app = app
+        self.max_requests = max_requests
+        self.timeout_s = timeout_s
+        self._router: Optional[ASGIApp] = None
+
+    @property
+    def router(self) -> ASGIApp:
+        # Роутер с обработчиками исключений приложения: HTTPException и ошибки валидации — обычные ответы
+        if self._router is None:
+            self._router = ExceptionMiddleware(self.app.router, handlers=self.app.exception_handlers)
+        return self._router
+
+    def _scope(self, parent: Scope, sub: BatchSubRequest, body: bytes, user: Any) -> Scope:
+        path, _, query = sub.path.partition("?")
+        headers = [(name, value) for name, value in parent["headers"] if name not in _SKIP_HEADERS]
+        headers += [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in sub.headers.items()]
+        if body:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        return {
+            "type": "http",
+            "asgi": parent.get("asgi", {"version": "3.0"}),
+            "http_version": parent.get("http_version", "1.1"),
+            "method": sub.method.upper(),
+            "scheme": parent.get("scheme", "http"),
+            "server": parent.get("server"),
+            "client": parent.get("client"),
+            "root_path": "",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "headers": headers,
+            "app": parent.get("app"),
+            # Пользователь исходного запроса: подзапросы не проходят аутентификацию повторно
+            "state": {**parent.get("state", {}), "user": user},
+        }
+
+    async def _run(self, parent: Scope, sub: BatchSubRequest, user: Any) -> Dict[str, Any]:
+        body = dumps(sub.body) if sub.body is not None else b""
+        try:
+            scope = self._scope(parent, sub, body, user)
+        except UnicodeEncodeError:
+            # Заголовки HTTP — latin-1; ошибка одного подзапроса не должна ронять весь пакет
+            return {"id": sub.id, "status": 400, "headers": {}, "body": {"detail": "Заголовки подзапроса должны быть в latin-1"}}
+        received = False
+        status, headers, chunks = 500, [], []
+
+        async def receive() -> Message:
+            nonlocal received
+            if received:
+                return {"type": "http.disconnect"}
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message: Message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status, headers = message["status"], message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        try:
+            await asyncio.wait_for(self.router(scope, receive, send), self.timeout_s)
+        except asyncio.TimeoutError:
+            return {"id": sub.id, "status": 504, "headers": {}, "body": {"detail": "Подзапрос не завершился вовремя"}}
+        except Exception as e:
+            LoggerUtils.log_error(f"Ошибка подзапроса {sub.method} {sub.path}", e)
+            return {"id": sub.id, "status": 500, "headers": {}, "body": {"detail": "Internal Server Error"}}
+
+        response_headers = {}
+        content_type = ""
+        for name, value in headers:
+            name = name.decode("latin-1").lower()
+            if name == "content-type":
+                content_type = value.decode("latin-1")
+            elif name not in _SKIP_RESPONSE_HEADERS:
+                response_headers[name] = value.decode("latin-1")
+        raw = b"".join(chunks)
+        if not raw:
+            result = None
+        elif "json" in content_type:
+            try:
+                result = json.loads(raw)
+            except ValueError:
+                # Тело с типом JSON, но не JSON (обрезанный или потоковый ответ) — отдаётся текстом
+                result = raw.decode("utf-8", errors="replace")
+        else:
+            result = raw.decode("utf-8", errors="replace")
+        return {"id": sub.id, "status": status, "headers": response_headers, "body": result}
+
+    async def execute(self, parent: Scope, requests: List[BatchSubRequest], user: Any) -> List[Dict[str, Any]]:
+        """Подряд идущие GET выполняются параллельно; запись — барьер, выполняется после предыдущих и до следующих"""
+        results: List[Dict[str, Any]] = []
+        reads: List[BatchSubRequest] = []
+
+        async def flush_reads():
+            if reads:
+                results.extend(await asyncio.gather(*(self._run(parent, sub, user) for sub in reads)))
+                reads.clear()
+
+        for sub in requests:
+            if sub.path.startswith("/api/batch"):
+                await flush_reads()
+                results.append({"id": sub.id, "status": 400, "headers": {}, "body": {"detail": "Вложенные пакеты не поддерживаются"}})
+            elif sub.method.upper() in ("GET", "HEAD"):
+                reads.append(sub)
+            else:
+                await flush_reads()
+                results.append(await self._run(parent, sub, user))
+        await flush_reads()
+        return results
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .settings import settings
+
+try:
+    import brotli
+except ImportError:  # brotli не установлен — сжимаем только gzip
+    brotli = None
+
+# Типы ответов, которые сжимаем: JSON-списки, NDJSON-выгрузки и поток логов (SSE)
+COMPRESSIBLE_TYPES = {"application/json", "application/x-ndjson", "text/event-stream"}
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Лучшая кодировка из Accept-Encoding: br (если есть brotli), затем gzip"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+class StreamCompressor:
+    """Потоковое сжатие: каждый чанк сбрасывается сразу, чтобы события SSE не задерживались"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._compressor.process(data)
+            return out + (self._compressor.finish() if final else self._compressor.flush())
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class ResponseCompressor:
+    """Сжатие тел ответов, кеш сжатых тел для ответов с ETag и статистика"""
+
+    def __init__(self, minimum_size: int, gzip_level: int, brotli_quality: int, cache_max_bytes: int,
+                 thread_min_size: int = 256 * 1024):
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache_max_bytes = cache_max_bytes
+        # Большие тела сжимаются в потоке, чтобы не блокировать event loop
+        self.thread_min_size = thread_min_size
+        # (путь, query, ETag, кодировка) -> сжатое тело, в порядке последнего использования
+        self._cache: "OrderedDict[Tuple[str, bytes, str, str], bytes]" = OrderedDict()
+        self._cache_bytes = 0
+        self._stats = {
+            "compressed": 0, "streamed": 0, "skipped": 0,
+            "bytesIn": 0, "bytesOut": 0, "cpuMs": 0.0,
+            "cacheHits": 0, "cacheMisses": 0,
+        }
+
+    def _compress(self, body: bytes, encoding: str) -> Tuple[bytes, float]:
+        started = time.thread_time()
+        if encoding == "br":
+            data = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            data = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        return data, (time.thread_time() - started) * 1000
+
+    async def compress_body(self, body: bytes, encoding: str, cache_key: Optional[Tuple[str, bytes, str, str]]) -> bytes:
+        """Сжатое тело ответа целиком; для ответов с ETag берётся из кеша"""
+        if cache_key is not None:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                self._stats["cacheHits"] += 1
+                self._count(len(body), len(cached))
+                return cached
+            self._stats["cacheMisses"] += 1
+
+        if len(body) >= self.thread_min_size:
+            data, cpu_ms = await asyncio.to_thread(self._compress, body, encoding)
+        else:
+            data, cpu_ms = self._compress(body, encoding)
+        self._stats["cpuMs"] += cpu_ms
+        self._count(len(body), len(data))
+        if cache_key is not None:
+            self._remember(cache_key, data)
+        return data
+
+    def stream(self, encoding: str) -> StreamCompressor:
+        self._stats["streamed"] += 1
+        return StreamCompressor(encoding, self.gzip_level, self.brotli_quality)
+
+    def compress_chunk(self, stream: StreamCompressor, data: bytes, final: bool) -> bytes:
+        started = time.thread_time()
+        out = stream.compress(data, final)
+        self._stats["cpuMs"] += (time.thread_time() - started) * 1000
+        self._stats["bytesIn"] += len(data)
+        self._stats["bytesOut"] += len(out)
+        return out
+
+    def skip(self):
+        self._stats["skipped"] += 1
+
+    def _count(self, size_in: int, size_out: int):
+        self._stats["compressed"] += 1
+        self._stats["bytesIn"] += size_in
+        self._stats["bytesOut"] += size_out
+
+    def _remember(self, key: Tuple[str, bytes, str, str], data: bytes):
+        if len(data) > self.cache_max_bytes:
+            return
+        previous = self._cache.pop(key, None)
+        if previous is not None:
+            self._cache_bytes -= len(previous)
+        self._cache[key] = data
+        self._cache_bytes += len(data)
+        while self._cache_bytes > self.cache_max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        bytes_in, bytes_out = self._stats["bytesIn"], self._stats["bytesOut"]
+        return {
+            "brotli": brotli is not None,
+            "minimumSize": self.minimum_size,
+            **self._stats,
+            "cpuMs": round(self._stats["cpuMs"], 1),
+            "bytesSaved": bytes_in - bytes_out,
+            "ratio": round(bytes_out / bytes_in, 3) if bytes_in else None,
+            "cacheEntries": len(self._cache),
+            "cacheBytes": self._cache_bytes,
+        }
+
+
+# Глобальный компрессор ответов
+response_compressor = ResponseCompressor(
+    minimum_size=settings.compression_min_size,
+    gzip_level=settings.compression_gzip_level,
+    brotli_quality=settings.compression_brotli_quality,
+    cache_max_bytes=settings.compression_cache_max_bytes,
+)
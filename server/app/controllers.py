@@ -1,5 +1,5 @@
 from fastapi import HTTPException, UploadFile, File
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from .models import (
     User, Service, ServiceEmployee, Order, HiringQueue,
     UserCreate, UserUpdate, ServiceCreate, ServiceUpdate,
@@ -7,8 +7,12 @@ from .models import (
     HiringQueueCreate, HiringQueueUpdate
 )
 from .services import UserService, ServiceService, EmployeeService, OrderService, HiringQueueService
+from .tracing import traced
+from .utils import TimeUtils
+from .analytics import GROUP_FIELDS
 
 
+@traced("controller")
 class UsersController:
     def __init__(self, user_service: UserService):
         self.user_service = user_service
@@ -56,6 +60,7 @@ class UsersController:
         }
 
 
+@traced("controller")
 class ServicesController:
     def __init__(self, service_service: ServiceService, employee_service: EmployeeService):
         self.service_service = service_service
@@ -103,6 +108,7 @@ class ServicesController:
         }
 
 
+@traced("controller")
 class EmployeesController:
     def __init__(self, employee_service: EmployeeService, user_service: UserService):
         self.employee_service = employee_service
@@ -116,8 +122,8 @@ class EmployeesController:
         for employee in employees:
             user = await self.user_service.get_user_by_id(employee.userId)
             employees_with_user_info.append({
-                **employee.dict(),
-                "user": user.dict() if user else None
+                **employee.model_dump(mode="json"),
+                "user": user.model_dump(mode="json") if user else None
             })
         
         return employees_with_user_info
@@ -199,6 +205,7 @@ class EmployeesController:
         }
 
 
+@traced("controller")
 class OrdersController:
     def __init__(self, order_service: OrderService, employee_service: EmployeeService):
         self.order_service = order_service
@@ -207,6 +214,58 @@ class OrdersController:
     async def get_all_orders(self) -> List[Order]:
         return await self.order_service.get_all_orders()
 
+    async def query_orders(
+        self,
+        service_id: Optional[int] = None,
+        status: Optional[str] = None,
+        created_by: Optional[int] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Order], Optional[str]]:
+        try:
+            from_ms = TimeUtils.to_ms(date_from)
+            to_ms = TimeUtils.to_ms(date_to)
+            before = tuple(int(part) for part in cursor.split(":", 1)) if cursor else None
+            if before is not None and len(before) != 2:
+                raise ValueError(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректные параметры фильтра")
+
+        orders, next_key = await self.order_service.query_orders(
+            service_id=service_id, status=status, created_by=created_by,
+            from_ms=from_ms, to_ms=to_ms, limit=limit, cursor=before
+        )
+        # Курсор следующей страницы: "created_at:id" последнего заказа
+        next_cursor = f"{next_key[0]}:{next_key[1]}" if next_key else None
+        return orders, next_cursor
+
+    async def get_service_stats(
+        self,
+        service_id: int,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        group_by: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        fields = [field.strip() for field in (group_by or "day").split(",") if field.strip()]
+        unknown = [field for field in fields if field not in GROUP_FIELDS]
+        if unknown or not fields:
+            raise HTTPException(
+                status_code=400,
+                detail=f"groupBy допускает: {', '.join(GROUP_FIELDS)}"
+            )
+        try:
+            from_ms = TimeUtils.to_ms(date_from)
+            to_ms = TimeUtils.to_ms(date_to)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный период")
+
+        return await self.order_service.get_service_stats(service_id, from_ms, to_ms, fields)
+
+    async def search_orders(self, service_id: int, query: str, limit: int = 50) -> List[Order]:
+        return await self.order_service.search_orders(service_id, query, limit)
+
     async def get_order_by_id(self, order_id: int) -> Order:
         order = await self.order_service.get_order_by_id(order_id)
         if not order:
@@ -258,6 +317,7 @@ class OrdersController:
         return {"nextNumber": next_number}
 
 
+@traced("controller")
 class HiringQueueController:
     def __init__(self, hiring_queue_service: HiringQueueService):
         self.hiring_queue_service = hiring_queue_service
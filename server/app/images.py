@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .settings import settings
+from .uploads import upload_store
+from .utils import LoggerUtils
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен — превью не генерируются
+    Image = None
+    ImageOps = None
+
+if Image is not None:
+    try:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:  # без pillow-heif фото HEIC/HEIF хранятся, но превью для них не делаются
+        pass
+
+# Формат Pillow, нужный для декодирования каждого типа фото
+PILLOW_FORMATS = {
+    "image/jpeg": "JPEG",
+    "image/png": "PNG",
+    "image/webp": "WEBP",
+    "image/heic": "HEIF",
+    "image/heif": "HEIF",
+}
+
+
+def render_variant(src: str, dst: str, max_side: int, quality: int) -> Tuple[int, int, int]:
+    """Уменьшенная JPEG-копия изображения (выполняется в отдельном процессе)"""
+    with Image.open(src) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        tmp = f"{dst}.{os.getpid()}.part"
+        image.save(tmp, "JPEG", quality=quality, optimize=True)
+        os.replace(tmp, dst)
+        return image.width, image.height, os.path.getsize(dst)
+
+
+def read_variant(dst: str) -> Optional[Tuple[int, int, int]]:
+    """Размеры уже готового превью; None, если его ещё нет (выполняется в потоке)"""
+    try:
+        with Image.open(dst) as existing:
+            width, height = existing.size
+        return width, height, os.path.getsize(dst)
+    except FileNotFoundError:
+        return None
+
+
+# Результат задания: digest -> вариант -> метаданные файла
+VariantsCallback = Callable[[int, str, Dict[str, Dict[str, Any]]], Awaitable[None]]
+
+
+class ImagePipeline:
+    """Фоновая генерация превью фото в пуле процессов, вне event loop"""
+
+    def __init__(self, variants: Dict[str, int], workers: int, queue_size: int, quality: int = 82):
+        self.variants = variants
+        self.workers = workers
+        self.quality = quality
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._on_done: Optional[VariantsCallback] = None
+        self._latencies = deque(maxlen=500)
+        self._stats = {"submitted": 0, "processed": 0, "failed": 0, "dropped": 0, "skipped": 0, "inFlight": 0}
+        self._decodable: Optional[set] = None
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None and self.workers > 0
+
+    def start(self, on_done: VariantsCallback):
+        """Запуск пула процессов и обработчиков очереди"""
+        if not self.enabled:
+            LoggerUtils.log_info("Генерация превью отключена (нет Pillow или image_workers=0)")
+            return
+        self._on_done = on_done
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def can_decode(self, mimetype: Optional[str]) -> bool:
+        """Есть ли в Pillow декодер для типа фото (HEIC/HEIF — только с pillow-heif)"""
+        if self._decodable is None:
+            Image.init()
+            self._decodable = {mime for mime, fmt in PILLOW_FORMATS.items() if fmt in Image.OPEN}
+        # Тип неизвестен (старые фото) — пробуем
+        return mimetype is None or mimetype in self._decodable
+
+    def submit(self, order_id: int, photos: Optional[List[Dict[str, Any]]]):
+        """Постановка фото заказа в очередь; не блокирует путь загрузки"""
+        if not self._tasks:
+            return
+        digests = set()
+        for photo in photos or []:
+            if not photo.get("digest"):
+                continue
+            if self.can_decode(photo.get("mimetype")):
+                digests.add(photo["digest"])
+            else:
+                self._stats["skipped"] += 1
+        for digest in digests:
+            try:
+                self._queue.put_nowait((order_id, digest, time.perf_counter()))
+                self._stats["submitted"] += 1
+            except asyncio.QueueFull:
+                self._stats["dropped"] += 1
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            order_id, digest, queued_at = await self._queue.get()
+            self._stats["inFlight"] += 1
+            try:
+                src = upload_store.path_for(digest)
+                result = {}
+                for variant, max_side in self.variants.items():
+                    dst = upload_store.variant_path(digest, variant)
+                    existing = await asyncio.to_thread(read_variant, str(dst))
+                    if existing is not None:
+                        width, height, size = existing
+                    else:
+                        width, height, size = await loop.run_in_executor(
+                            self._pool, render_variant, str(src), str(dst), max_side, self.quality
+                        )
+                    result[variant] = {
+                        "path": f"/uploads/{digest}/{variant}",
+                        "width": width,
+                        "height": height,
+                        "size": size
+                    }
+                await self._on_done(order_id, digest, result)
+                self._stats["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                LoggerUtils.log_error(f"Не удалось создать превью {digest}", e)
+            finally:
+                self._stats["inFlight"] -= 1
+                self._latencies.append(time.perf_counter() - queued_at)
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, счётчики и задержка заданий (от постановки до результата)"""
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "queueDepth": self._queue.qsize(),
+            **self._stats,
+            "latencyMs": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)},
+        }
+
+
+# Глобальный конвейер превью
+image_pipeline = ImagePipeline(
+    variants={"thumbnail": settings.image_thumbnail_size, "preview": settings.image_preview_size},
+    workers=settings.image_workers,
+    queue_size=settings.image_queue_size,
+)
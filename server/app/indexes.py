@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import re
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+# Ключ сортировки внутри индекса: (created_at, id)
+IndexKey = Tuple[int, int]
+
+_MIN_ID = float("-inf")
+_MAX_ID = float("inf")
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: Optional[str]) -> Set[str]:
+    """Токены комментария для полнотекстового поиска"""
+    return set(_TOKEN_RE.findall(text.lower())) if text else set()
+
+
+class OrderIndexBase(ABC):
+    """Базовый класс индексов, которые строятся из таблицы orders и обновляются инкрементально"""
+
+    def __init__(self):
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    async def ensure_loaded(self, db):
+        """Построение индекса из хранилища при первом обращении"""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            for doc in await db.list("orders"):
+                self.add(doc)
+            self._loaded = True
+
+    @abstractmethod
+    def add(self, doc: Dict[str, Any]):
+        """Добавление документа заказа в индекс"""
+
+    @abstractmethod
+    def remove(self, doc: Dict[str, Any]):
+        """Удаление документа заказа из индекса"""
+
+    def replace(self, old: Optional[Dict[str, Any]], new: Dict[str, Any]):
+        if old:
+            self.remove(old)
+        self.add(new)
+
+
+class OrderIndex(OrderIndexBase):
+    """In-memory индексы заказов: (serviceId, status, created_at) и (created_by_id, created_at)"""
+
+    def __init__(self):
+        super().__init__()
+        self._docs: Dict[int, Dict[str, Any]] = {}
+        self._by_service_status: Dict[Tuple[Optional[int], str], List[IndexKey]] = {}
+        self._service_statuses: Dict[Optional[int], set] = {}
+        self._by_creator: Dict[Optional[int], List[IndexKey]] = {}
+        self._by_created: List[IndexKey] = []
+
+    @staticmethod
+    def _key(doc: Dict[str, Any]) -> IndexKey:
+        return (doc.get("created_at") or 0, doc["id"])
+
+    def add(self, doc: Dict[str, Any]):
+        doc = dict(doc)
+        key = self._key(doc)
+        service_id, status = doc.get("serviceId"), doc.get("status", "active")
+        self._docs[doc["id"]] = doc
+        insort(self._by_service_status.setdefault((service_id, status), []), key)
+        self._service_statuses.setdefault(service_id, set()).add(status)
+        insort(self._by_creator.setdefault(doc.get("created_by_id"), []), key)
+        insort(self._by_created, key)
+
+    def remove(self, doc: Dict[str, Any]):
+        doc = self._docs.pop(doc["id"], None)
+        if not doc:
+            return
+        key = self._key(doc)
+        service_id, status = doc.get("serviceId"), doc.get("status", "active")
+        self._discard(self._by_service_status, (service_id, status), key)
+        if (service_id, status) not in self._by_service_status:
+            self._service_statuses[service_id].discard(status)
+            if not self._service_statuses[service_id]:
+                del self._service_statuses[service_id]
+        self._discard(self._by_creator, doc.get("created_by_id"), key)
+        self._remove_key(self._by_created, key)
+
+    def get(self, order_id: int) -> Optional[Dict[str, Any]]:
+        return self._docs.get(order_id)
+
+    def _discard(self, index: Dict[Any, List[IndexKey]], bucket: Any, key: IndexKey):
+        keys = index.get(bucket)
+        if keys is None:
+            return
+        self._remove_key(keys, key)
+        if not keys:
+            del index[bucket]
+
+    @staticmethod
+    def _remove_key(keys: List[IndexKey], key: IndexKey):
+        pos = bisect_left(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            del keys[pos]
+
+    @staticmethod
+    def _range_desc(keys: List[IndexKey], from_ms: Optional[int], to_ms: Optional[int],
+                    before: Optional[IndexKey]) -> Iterator[IndexKey]:
+        """Ключи диапазона [from_ms, to_ms] от новых к старым, строго раньше курсора"""
+        lo = bisect_left(keys, (from_ms, _MIN_ID)) if from_ms is not None else 0
+        hi = bisect_right(keys, (to_ms, _MAX_ID)) if to_ms is not None else len(keys)
+        if before is not None:
+            hi = min(hi, bisect_left(keys, before))
+        for pos in range(hi - 1, lo - 1, -1):
+            yield keys[pos]
+
+    def query(
+        self,
+        service_id: Optional[int] = None,
+        status: Optional[str] = None,
+        created_by: Optional[int] = None,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        limit: Optional[int] = None,
+        before: Optional[IndexKey] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[IndexKey]]:
+        """Заказы по фильтрам (новые первыми) и курсор следующей страницы"""
+        if service_id is not None:
+            statuses = [status] if status else sorted(self._service_statuses.get(service_id, ()))
+            sources = [
+                self._range_desc(self._by_service_status.get((service_id, st), []), from_ms, to_ms, before)
+                for st in statuses
+            ]
+            keys = heapq.merge(*sources, reverse=True) if len(sources) > 1 else (sources[0] if sources else iter(()))
+        elif created_by is not None:
+            keys = self._range_desc(self._by_creator.get(created_by, []), from_ms, to_ms, before)
+        else:
+            keys = self._range_desc(self._by_created, from_ms, to_ms, before)
+
+        result: List[Dict[str, Any]] = []
+        last_key: Optional[IndexKey] = None
+        for key in keys:
+            doc = self._docs[key[1]]
+            # Остаточные фильтры, не покрытые выбранным индексом
+            if status and doc.get("status") != status:
+                continue
+            if created_by is not None and doc.get("created_by_id") != created_by:
+                continue
+            if limit is not None and len(result) >= limit:
+                return result, last_key
+            result.append(doc)
+            last_key = key
+        return result, None
+
+
+class OrderSearchIndex(OrderIndexBase):
+    """Поиск заказов в пределах сервиса: префикс orderNumber и слова из comment"""
+
+    def __init__(self):
+        super().__init__()
+        # serviceId -> отсортированный список (orderNumber, id)
+        self._numbers: Dict[Optional[int], List[Tuple[str, int]]] = {}
+        # serviceId -> токен -> id заказов
+        self._tokens: Dict[Optional[int], Dict[str, Set[int]]] = {}
+        # id -> (serviceId, orderNumber, токены) для удаления без исходного документа
+        self._entries: Dict[int, Tuple[Optional[int], str, Set[str]]] = {}
+
+    def add(self, doc: Dict[str, Any]):
+        order_id, service_id = doc["id"], doc.get("serviceId")
+        number = doc.get("orderNumber", "")
+        tokens = tokenize(doc.get("comment"))
+        self._entries[order_id] = (service_id, number, tokens)
+        insort(self._numbers.setdefault(service_id, []), (number, order_id))
+        postings = self._tokens.setdefault(service_id, {})
+        for token in tokens:
+            postings.setdefault(token, set()).add(order_id)
+
+    def remove(self, doc: Dict[str, Any]):
+        entry = self._entries.pop(doc["id"], None)
+        if not entry:
+            return
+        service_id, number, tokens = entry
+        numbers = self._numbers.get(service_id, [])
+        pos = bisect_left(numbers, (number, doc["id"]))
+        if pos < len(numbers) and numbers[pos] == (number, doc["id"]):
+            del numbers[pos]
+        postings = self._tokens.get(service_id, {})
+        for token in tokens:
+            ids = postings.get(token)
+            if ids is not None:
+                ids.discard(doc["id"])
+                if not ids:
+                    del postings[token]
+
+    def search_number_prefix(self, service_id: Optional[int], prefix: str, limit: int) -> List[int]:
+        """id заказов с orderNumber, начинающимся с prefix (старшие номера первыми)"""
+        numbers = self._numbers.get(service_id, [])
+        lo = bisect_left(numbers, (prefix,))
+        # Все строки с префиксом лежат перед prefix + максимальный символ
+        hi = bisect_left(numbers, (prefix + "\U0010ffff",), lo)
+        return [order_id for _, order_id in reversed(numbers[max(lo, hi - limit):hi])]
+
+    def search_comment(self, service_id: Optional[int], query: str, limit: int) -> List[int]:
+        """id заказов, в комментарии которых есть все слова запроса (новые первыми)"""
+        tokens = tokenize(query)
+        postings = self._tokens.get(service_id, {})
+        if not tokens:
+            return []
+        # Пересекаем начиная с самого короткого списка
+        sets = sorted((postings.get(token, set()) for token in tokens), key=len)
+        ids = set(sets[0])
+        for other in sets[1:]:
+            ids &= other
+            if not ids:
+                break
+        return heapq.nlargest(limit, ids)
+
+    def search(self, service_id: Optional[int], query: str, limit: int = 50) -> List[int]:
+        """Совпадения по номеру идут первыми, затем по комментарию"""
+        query = query.strip()
+        if not query:
+            return []
+        result = self.search_number_prefix(service_id, query, limit)
+        if len(result) < limit:
+            seen = set(result)
+            for order_id in self.search_comment(service_id, query, limit):
+                if order_id not in seen:
+                    result.append(order_id)
+                    if len(result) >= limit:
+                        break
+        return result
+
+
+# Глобальные экземпляры индексов заказов
+order_index = OrderIndex()
+order_search_index = OrderSearchIndex()
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from .settings import settings
+
+# Стандартные атрибуты LogRecord; остальные (переданные через extra) попадают в JSON отдельными полями
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON; сообщение собирается здесь, в потоке записи"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogSampler:
+    """Доля записываемых массовых событий по уровням: при доле 0.1 пишется каждое 10-е"""
+
+    def __init__(self, rates: Dict[str, float]):
+        self._every: Dict[int, int] = {}
+        for level_name, rate in rates.items():
+            level = logging.getLevelName(level_name.upper())
+            if isinstance(level, int):
+                self._every[level] = 0 if rate <= 0 else max(1, round(1 / rate))
+        self._counters: Dict[int, int] = {}
+        self.sampled_out = 0
+
+    def keep(self, level: int) -> bool:
+        every = self._every.get(level, 1)
+        if every == 1:
+            return True
+        count = self._counters.get(level, 0) + 1
+        self._counters[level] = count
+        if every and count % every == 0:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class _PipelineQueueHandler(QueueHandler):
+    """Кладёт запись в очередь без форматирования и считает время, потраченное вызывающим кодом"""
+
+    def __init__(self, pipeline: "LogPipeline"):
+        super().__init__(pipeline.queue)
+        self._pipeline = pipeline
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Сообщение и исключение форматируются в потоке записи, а не в event loop
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            self._pipeline.enqueued += 1
+        except queue.Full:
+            self._pipeline.dropped += 1
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        started = time.perf_counter_ns()
+        try:
+            return super().handle(record)
+        finally:
+            self._pipeline.caller_ns += time.perf_counter_ns() - started
+
+
+class LogPipeline:
+    """Логи через очередь: вызывающий код только кладёт запись, в stdout пишет фоновый поток QueueListener"""
+
+    def __init__(self, level: str, fmt: str, sample_rates: Dict[str, float], queue_size: int):
+        self.level = logging.getLevelName(level.upper())
+        self.fmt = fmt
+        self.sampler = LogSampler(sample_rates)
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.enqueued = 0
+        self.dropped = 0
+        self.caller_ns = 0
+        self._listener: Optional[QueueListener] = None
+
+    def start(self):
+        """Замена обработчиков корневого логгера на очередь и запуск потока записи"""
+        if self._listener:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        if self.fmt == "json":
+            output.setFormatter(JsonLineFormatter())
+        else:
+            output.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+        root = logging.getLogger()
+        root.handlers = [_PipelineQueueHandler(self)]
+        root.setLevel(self.level)
+        self._listener = QueueListener(self.queue, output)
+        self._listener.start()
+
+    def stop(self):
+        """Остановка потока записи; оставшиеся в очереди записи дописываются"""
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._listener is not None,
+            "level": logging.getLevelName(self.level),
+            "format": self.fmt,
+            "queueDepth": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "sampledOut": self.sampler.sampled_out,
+            # Среднее время постановки записи в очередь на стороне вызывающего кода
+            "callerUsPerRecord": round(self.caller_ns / self.enqueued / 1000, 2) if self.enqueued else None,
+        }
+
+
+# Глобальный конвейер логов
+log_pipeline = LogPipeline(
+    level=settings.log_level,
+    fmt=settings.log_format,
+    sample_rates=settings.log_sample_rates,
+    queue_size=settings.log_queue_size,
+)
@@ -1,10 +1,8 @@
-from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Depends, Path
-from fastapi.responses import JSONResponse, StreamingResponse
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Depends, Query
+from fastapi.responses import Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-from datetime import datetime
 import asyncio
 import json
 
@@ -14,7 +12,7 @@ from .models import (
     User, Service, ServiceEmployee, Order, HiringQueue,
     UserCreate, UserUpdate, ServiceCreate, ServiceUpdate,
     EmployeeCreate, EmployeeUpdate, OrderCreate, OrderUpdate,
-    HiringQueueCreate, HiringQueueUpdate
+    HiringQueueCreate, HiringQueueUpdate, OrderStatus, BatchRequest
 )
 from .services import UserService, ServiceService, EmployeeService, OrderService, HiringQueueService
 from .controllers import (
@@ -22,50 +20,67 @@ from .controllers import (
     OrdersController, HiringQueueController
 )
 from .middleware import (
-    TelegramAuth, RegistrationCheck, log_requests,
-    get_current_user, require_authentication, require_admin
+    TelegramAuth, RegistrationCheck, UploadAdmissionMiddleware, CompressionMiddleware, CorsLoggingMiddleware,
+    RequestProfilingMiddleware, TracingMiddleware,
+    get_current_user, require_authentication, require_admin, rate_limit
+)
+from .utils import LoggerUtils, TimeUtils, SessionService, client_logger
+from .migrations import run_migrations
+from .uploads import DIGEST_RE, upload_store, upload_sessions, upload_admission
+from .images import image_pipeline
+from .compression import response_compressor
+from .logs import log_pipeline
+from .auth import identity_cache, last_seen
+from .ratelimit import rate_limiter
+from .profiling import request_profiler, sampling_profiler
+from .tracing import tracer
+from .singleflight import single_flight
+from .batch import BatchDispatcher
+from .transfer import IMPORT_MODELS, TableTransfer
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics, storage_stats
+from .responses import (
+    FastJSONResponse, FastJSONRoute, conditional_json, immutable_file_response, immutable_not_modified, not_modified
 )
-from .utils import LoggerUtils, client_logger
 
-app = FastAPI(title="PedantTW Server", version="0.1.0")
+# Лимиты запросов — зависимость каждого маршрута (после маршрутизации известны шаблон пути и пользователь)
+app = FastAPI(
+    title="PedantTW Server",
+    version="0.1.0",
+    default_response_class=FastJSONResponse,
+    dependencies=[Depends(rate_limit)],
+)
+# Все маршруты сериализуют ответ через FastJSONResponse
+app.router.route_class = FastJSONRoute
 
 # Обработчик ошибок для возврата JSON вместо HTML
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc: HTTPException):
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=404,
         content={"detail": "Not Found", "path": str(request.url.path)}
     )
 
 @app.exception_handler(500)
 async def internal_error_handler(request: Request, exc: Exception):
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=500,
         content={"detail": "Internal Server Error", "error": str(exc)}
     )
 
-# CORS: временно максимально либеральный, чтобы исключить проблемы туннеля cloudpub
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=False,  # Должно быть False при allow_origins=["*"]
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"]
-)
+# cProfile отдельных запросов по заголовку X-Profile — ближе всех к приложению
+app.add_middleware(RequestProfilingMiddleware)
+
+# Допуск загрузок по суммарному объёму — до чтения тела запроса
+app.add_middleware(UploadAdmissionMiddleware)
 
-# Добавляем middleware для логирования
-app.middleware("http")(log_requests)
+# Сжатие JSON-ответов (gzip/br)
+app.add_middleware(CompressionMiddleware)
 
-# Дополнительные CORS заголовки
-@app.middleware("http")
-async def add_cors_headers(request: Request, call_next):
-    response = await call_next(request)
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
-    response.headers["Access-Control-Allow-Headers"] = "*"
-    response.headers["Access-Control-Expose-Headers"] = "*"
-    return response
+# Трассировка запросов из выборки: участки контроллеров, сервисов и хранилища
+app.add_middleware(TracingMiddleware)
+
+# CORS, preflight и логирование запросов — одним ASGI-слоем, снаружи остальных
+app.add_middleware(CorsLoggingMiddleware)
 
 # Добавляем обслуживание статических файлов
 try:
@@ -79,6 +94,7 @@ service_service = ServiceService(user_service)
 employee_service = EmployeeService(user_service)
 order_service = OrderService(user_service, service_service)
 hiring_queue_service = HiringQueueService(user_service)
+session_service = SessionService(db, ttl_s=settings.session_ttl_s)
 
 # Инициализация контроллеров
 users_controller = UsersController(user_service)
@@ -87,22 +103,95 @@ employees_controller = EmployeesController(employee_service, user_service)
 orders_controller = OrdersController(order_service, employee_service)
 hiring_queue_controller = HiringQueueController(hiring_queue_service)
 
+# Экспорт и импорт таблиц
+table_transfer = TableTransfer(db, order_service, settings.transfer_batch_size, settings.transfer_max_line_bytes)
+
+# Пакетные запросы выполняются роутером этого же приложения
+batch_dispatcher = BatchDispatcher(app, settings.batch_max_requests, settings.batch_timeout_s)
+
+
+# Фоновые задачи держим по ссылке, чтобы их не собрал сборщик мусора
+background_tasks = set()
+
+
+def start_background_task(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+@app.on_event("startup")
+async def start_log_pipeline():
+    # Первым из startup-хуков: сообщения остальных уже идут через очередь
+    log_pipeline.start()
+
+
+@app.on_event("startup")
+async def start_clock():
+    start_background_task(TimeUtils.run_clock_loop(settings.clock_resolution_ms))
+
+
+@app.on_event("startup")
+async def apply_migrations():
+    await run_migrations(db)
+
+
+@app.on_event("startup")
+async def start_upload_gc():
+    start_background_task(upload_store.run_gc_loop(settings.upload_gc_interval_s))
+
+
+@app.on_event("startup")
+async def start_upload_session_expiry():
+    start_background_task(upload_sessions.run_expiry_loop(settings.upload_gc_interval_s))
+
+
+@app.on_event("startup")
+async def start_last_seen_flush():
+    start_background_task(last_seen.run_flush_loop(settings.last_seen_flush_interval_s))
+
+
+@app.on_event("startup")
+async def start_sessions():
+    await session_service.load()
+    start_background_task(session_service.run_maintenance_loop(settings.session_flush_interval_s))
+
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    start_background_task(metrics.run_loop_lag_monitor())
+
+
+@app.on_event("startup")
+async def start_image_pipeline():
+    image_pipeline.start(on_done=order_service.attach_photo_variants)
+
+
+@app.on_event("shutdown")
+async def stop_image_pipeline():
+    await image_pipeline.stop()
+
+
+@app.on_event("shutdown")
+async def flush_last_seen():
+    await last_seen.flush()
+
+
+@app.on_event("shutdown")
+async def flush_sessions():
+    session_service.sweep()
+    await session_service.flush()
+
+
+@app.on_event("shutdown")
+async def stop_log_pipeline():
+    log_pipeline.stop()
 
-@app.options("/{full_path:path}")
-async def options_handler(full_path: str = Path(...)):
-    return JSONResponse(
-        content={"message": "OK"},
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS, PATCH",
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Max-Age": "86400"
-        }
-    )
 
 @app.get("/")
 async def root():
-    return JSONResponse({
+    return FastJSONResponse({
         "message": "PedantTW Server is running",
         "version": app.version,
         "api_base": settings.api_base,
@@ -118,12 +207,12 @@ async def root():
 async def health(request: Request):
     origin = request.headers.get("origin") or request.client.host if request.client else None
     ua = request.headers.get("user-agent", "")
-    return JSONResponse(
+    return FastJSONResponse(
         {
             "status": "ok",
             "version": app.version,
             "environment": settings.node_env,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": TimeUtils.now_iso(),
             "api_base": settings.api_base,
             "cors": {
                 "origin": origin or "",
@@ -138,6 +227,20 @@ async def health(request: Request):
     )
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE, headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/api/batch")
+async def batch(request: Request, payload: BatchRequest):
+    """Несколько запросов к существующим маршрутам за один round-trip; аутентификация — одна на пакет"""
+    if len(payload.requests) > settings.batch_max_requests:
+        raise HTTPException(status_code=413, detail=f"Не больше {settings.batch_max_requests} подзапросов в пакете")
+    user = await get_current_user(request)
+    return {"responses": await batch_dispatcher.execute(request.scope, payload.requests, user)}
+
+
 @app.get("/config.json")
 async def runtime_config():
     api_base = settings.api_base
@@ -147,7 +250,7 @@ async def runtime_config():
     else:
         final_api_base = f"{api_base}/api"
     
-    return JSONResponse(
+    return FastJSONResponse(
         {
             "API_BASE": final_api_base,
             "NODE_ENV": settings.node_env,
@@ -163,13 +266,15 @@ async def runtime_config():
 
 # ===== USERS API =====
 @app.get("/api/users")
-async def get_users(current_user: User = Depends(require_authentication)):
-    return await users_controller.get_all_users()
+async def get_users(request: Request, current_user: User = Depends(require_authentication)):
+    return await conditional_json(request, db.etag("users"), users_controller.get_all_users)
 
 
 @app.get("/api/users/{user_id}")
-async def get_user(user_id: int, current_user: User = Depends(require_authentication)):
-    return await users_controller.get_user_by_id(user_id)
+async def get_user(request: Request, user_id: int, current_user: User = Depends(require_authentication)):
+    return await conditional_json(
+        request, db.etag(("users", user_id)), lambda: users_controller.get_user_by_id(user_id)
+    )
 
 
 @app.post("/api/users")
@@ -192,18 +297,33 @@ async def update_user(user_id: int, update_data: UserUpdate, current_user: User
 
 # ===== SERVICES API =====
 @app.get("/api/services")
-async def get_services(current_user: User = Depends(require_authentication)):
-    return await services_controller.get_all_services()
+async def get_services(request: Request, current_user: User = Depends(require_authentication)):
+    return await conditional_json(request, db.etag("services"), services_controller.get_all_services)
 
 
 @app.get("/api/services/{service_id}")
-async def get_service(service_id: int, current_user: User = Depends(require_authentication)):
-    return await services_controller.get_service_by_id(service_id)
+async def get_service(request: Request, service_id: int, current_user: User = Depends(require_authentication)):
+    return await conditional_json(
+        request, db.etag(("services", service_id)), lambda: services_controller.get_service_by_id(service_id)
+    )
+
+
+@app.get("/api/services/{service_id}/stats")
+async def get_service_stats(
+    service_id: int,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    groupBy: Optional[str] = None,
+    current_user: User = Depends(require_authentication)
+):
+    return await orders_controller.get_service_stats(service_id, date_from, date_to, groupBy)
 
 
 @app.get("/api/services/owner/{owner_id}")
-async def get_services_by_owner(owner_id: int, current_user: User = Depends(require_authentication)):
-    return await services_controller.get_services_by_owner(owner_id)
+async def get_services_by_owner(request: Request, owner_id: int, current_user: User = Depends(require_authentication)):
+    return await conditional_json(
+        request, db.etag("services"), lambda: services_controller.get_services_by_owner(owner_id)
+    )
 
 
 @app.post("/api/services")
@@ -223,13 +343,19 @@ async def delete_service(service_id: int, current_user: User = Depends(require_a
 
 # ===== EMPLOYEES API =====
 @app.get("/api/employees/service/{service_id}")
-async def get_employees_by_service(service_id: int, current_user: User = Depends(require_authentication)):
-    return await employees_controller.get_employees_by_service(service_id)
+async def get_employees_by_service(request: Request, service_id: int, current_user: User = Depends(require_authentication)):
+    return await conditional_json(
+        request,
+        db.etag("serviceEmployees", "users"),
+        lambda: employees_controller.get_employees_by_service(service_id)
+    )
 
 
 @app.get("/api/employees/user/{user_id}")
-async def get_employees_by_user(user_id: int, current_user: User = Depends(require_authentication)):
-    return await employees_controller.get_employees_by_user(user_id)
+async def get_employees_by_user(request: Request, user_id: int, current_user: User = Depends(require_authentication)):
+    return await conditional_json(
+        request, db.etag("serviceEmployees"), lambda: employees_controller.get_employees_by_user(user_id)
+    )
 
 
 @app.post("/api/employees")
@@ -266,21 +392,61 @@ async def hire_employee(payload: dict, current_user: User = Depends(require_auth
 
 # ===== ORDERS API =====
 @app.get("/api/orders")
-async def get_orders():
+async def get_orders(
+    request: Request,
+    serviceId: Optional[int] = None,
+    status: Optional[OrderStatus] = None,
+    createdBy: Optional[int] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(require_authentication)
+):
+    # Версия снимается до чтения: запись во время запроса даст новый ETag при следующем запросе
+    etag = db.etag("orders", "users")
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
     try:
-        result = await orders_controller.get_all_orders()
-        return JSONResponse(result, headers={"Content-Type": "application/json"})
+        result, next_cursor = await orders_controller.query_orders(
+            service_id=serviceId,
+            status=status.value if status else None,
+            created_by=createdBy,
+            date_from=date_from,
+            date_to=date_to,
+            limit=limit,
+            cursor=cursor
+        )
+        headers = {"Content-Type": "application/json", "ETag": etag, "Cache-Control": "no-cache"}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return FastJSONResponse(result, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
-        return JSONResponse(
+        return FastJSONResponse(
             {"error": str(e), "orders": []},
             status_code=500,
             headers={"Content-Type": "application/json"}
         )
 
 
+@app.get("/api/orders/search")
+async def search_orders(
+    serviceId: int,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(require_authentication)
+):
+    return await orders_controller.search_orders(serviceId, q, limit)
+
+
 @app.get("/api/orders/{order_id}")
-async def get_order(order_id: int, current_user: User = Depends(require_authentication)):
-    return await orders_controller.get_order_by_id(order_id)
+async def get_order(request: Request, order_id: int, current_user: User = Depends(require_authentication)):
+    return await conditional_json(
+        request, db.etag(("orders", order_id), "users"), lambda: orders_controller.get_order_by_id(order_id)
+    )
 
 
 @app.post("/api/orders")
@@ -290,20 +456,18 @@ async def create_order(
     created_by_id: int = Form(...),
     comment: str = Form(""),
     photos: List[UploadFile] = File(default=[]),
+    uploadSessions: List[str] = Form(default=[]),
     current_user: User = Depends(require_authentication)
 ):
-    # Обработка загруженных файлов
-    processed_photos = []
-    for photo in photos:
-        if photo.filename:
-            # Сохраняем файл (упрощенная версия)
-            file_data = await photo.read()
-            processed_photos.append({
-                "filename": photo.filename,
-                "size": len(file_data),
-                "mimetype": photo.content_type,
-                "path": f"/uploads/{photo.filename}"
-            })
+    # Фото из завершённых возобновляемых загрузок
+    processed_photos = await upload_sessions.claim(uploadSessions)
+
+    # Файлы пишутся на диск потоково (в памяти только текущий чанк), параллельно до upload_parallelism.
+    # Если заказ не будет создан, файлы без ссылок удалит сборщик мусора
+    processed_photos += await upload_store.save_many(
+        [photo for photo in photos if photo.filename],
+        parallelism=settings.upload_parallelism
+    )
     
     order_data = OrderCreate(
         serviceId=serviceId,
@@ -313,7 +477,9 @@ async def create_order(
         photos=processed_photos
     )
     
-    return await orders_controller.create_order(order_data)
+    result = await orders_controller.create_order(order_data)
+    await upload_sessions.close(uploadSessions)
+    return result
 
 
 @app.put("/api/orders/{order_id}")
@@ -331,6 +497,61 @@ async def get_next_order_number(service_number: str, current_user: User = Depend
     return await orders_controller.get_next_order_number(service_number)
 
 
+# ===== UPLOAD SESSIONS =====
+@app.post("/api/uploads/sessions")
+async def create_upload_session(payload: dict, current_user: User = Depends(require_authentication)):
+    size = payload.get("size")
+    if not isinstance(size, int):
+        raise HTTPException(status_code=400, detail="size is required")
+    return await upload_sessions.create(payload.get("filename"), size)
+
+
+@app.get("/api/uploads/sessions/{session_id}")
+async def get_upload_session(session_id: str, current_user: User = Depends(require_authentication)):
+    return await upload_sessions.get(session_id)
+
+
+@app.put("/api/uploads/sessions/{session_id}")
+async def upload_session_chunk(
+    session_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: User = Depends(require_authentication)
+):
+    return await upload_sessions.append(session_id, offset, request.stream())
+
+
+@app.post("/api/uploads/sessions/{session_id}/finalize")
+async def finalize_upload_session(session_id: str, current_user: User = Depends(require_authentication)):
+    return await upload_sessions.finalize(session_id)
+
+
+# ===== PHOTOS =====
+@app.api_route("/uploads/{digest}", methods=["GET", "HEAD"])
+async def get_photo(digest: str, request: Request):
+    if not DIGEST_RE.match(digest):
+        raise HTTPException(status_code=404, detail="Фото не найдено")
+    # Имя файла — SHA-256 содержимого, поэтому ETag сильный и 304 отдаётся до обращения к файлу
+    etag = f'"{digest}"'
+    cached = immutable_not_modified(request, etag)
+    if cached is not None:
+        return cached
+    path = upload_store.path_for(digest)
+    try:
+        media_type = await upload_store.media_type(digest)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Фото не найдено")
+    return immutable_file_response(request, path, etag, media_type)
+
+
+@app.api_route("/uploads/{digest}/{variant}", methods=["GET", "HEAD"])
+async def get_photo_variant(digest: str, variant: str, request: Request):
+    if not DIGEST_RE.match(digest) or variant not in image_pipeline.variants:
+        raise HTTPException(status_code=404, detail="Фото не найдено")
+    path = upload_store.variant_path(digest, variant)
+    return immutable_file_response(request, path, f'"{digest}-{variant}"', "image/jpeg")
+
+
 # ===== HIRING QUEUE API =====
 @app.post("/api/hiring-queue")
 async def add_to_queue(payload: dict, current_user: User = Depends(require_authentication)):
@@ -374,14 +595,14 @@ async def get_queue_stats(employer_id: int, current_user: User = Depends(require
 # ===== LEGACY ENDPOINTS =====
 @app.get("/api/settings")
 async def get_settings():
-    return JSONResponse(
+    return FastJSONResponse(
         {"locale": "ru", "features": {}, "theme": "light"},
         headers={"Content-Type": "application/json"}
     )
 
 
 @app.post("/api/init")
-async def init_user(payload: dict):
+async def init_user(payload: dict, request: Request):
     # ожидаем структуру WebApp initData преобразованную на клиенте
     user = payload.get("user") or {}
     # минимальный набор полей
@@ -394,8 +615,16 @@ async def init_user(payload: dict):
         "role": "user",
     }
     saved = await db.upsert("users", {k: v for k, v in data.items() if v is not None}, key_field="id")
-    session = {"token": f"sess-{saved['id']}", "createdAt": datetime.utcnow().isoformat() + "Z"}
-    return JSONResponse(
+    session = await session_service.create_session(
+        saved["id"], request.headers.get("user-agent", ""), request.client.host if request.client else ""
+    )
+    session = {
+        "id": session["token"],
+        "token": session["token"],
+        "createdAt": TimeUtils.to_iso(session["createdAt"]),
+        "expiresAt": TimeUtils.to_iso(session["expiresAt"]),
+    }
+    return FastJSONResponse(
         {"user": saved, "session": session},
         headers={"Content-Type": "application/json"}
     )
@@ -408,7 +637,7 @@ async def logs_stream():
         while True:
             counter += 1
             payload = {
-                "ts": datetime.utcnow().isoformat() + "Z",
+                "ts": TimeUtils.now_iso(),
                 "msg": "heartbeat",
                 "n": counter,
             }
@@ -426,6 +655,44 @@ async def logs_stream():
     )
 
 
+# ===== ADMIN ENDPOINTS =====
+@app.get("/api/admin/export/{table}")
+async def export_table(
+    table: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: User = Depends(require_admin),
+):
+    """Потоковая выгрузка таблицы: NDJSON, для заказов также CSV"""
+    if table not in db.tables():
+        raise HTTPException(status_code=404, detail="Таблица не найдена")
+    if format == "csv":
+        if table != "orders":
+            raise HTTPException(status_code=400, detail="CSV поддерживается только для orders")
+        body, media_type = table_transfer.export_orders_csv(), "text/csv; charset=utf-8"
+    else:
+        body, media_type = table_transfer.export_ndjson(table), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"', "Cache-Control": "no-store"},
+    )
+
+
+@app.post("/api/admin/import/{table}")
+async def import_table(table: str, request: Request, current_user: User = Depends(require_admin)):
+    """Потоковая загрузка NDJSON: проверка моделью и upsert по id пачками"""
+    if table not in IMPORT_MODELS:
+        raise HTTPException(status_code=400, detail=f"Импорт поддерживается для: {', '.join(IMPORT_MODELS)}")
+    result = await table_transfer.import_ndjson(table, request.stream())
+    LoggerUtils.log_info(f"📦 Импорт {table}: записано {result['imported']}, ошибок {result['failed']}")
+    return result
+
+
+@app.post("/api/admin/uploads/gc")
+async def collect_upload_garbage(current_user: User = Depends(require_admin)):
+    return await upload_store.collect_garbage()
+
+
 # ===== DEBUG ENDPOINTS =====
 @app.post("/api/debug/hire")
 async def debug_hire(payload: dict):
@@ -447,25 +714,114 @@ async def debug_db():
         service_employees = await db.list("serviceEmployees")
         hiring_queue = await db.list("hiringQueue")
         
-        return JSONResponse({
+        return FastJSONResponse({
             "users": len(users),
             "services": len(services),
-            "serviceEmployees": service_employees,
+            "serviceEmployees": [ServiceEmployee(**emp).model_dump(mode="json") for emp in service_employees],
             "hiringQueue": len(hiring_queue),
             "status": "ok"
         })
     except Exception as e:
-        return JSONResponse(
+        return FastJSONResponse(
             {"error": str(e), "status": "error"},
             status_code=500
         )
 
 
+@app.get("/api/debug/profile")
+async def debug_profile(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    current_user: User = Depends(require_admin),
+):
+    """Семплирование стеков всех потоков; ответ — collapsed stacks для flamegraph.pl/speedscope"""
+    stacks = await sampling_profiler.profile(seconds, interval_ms / 1000)
+    if stacks is None:
+        raise HTTPException(status_code=409, detail="Профилирование уже выполняется")
+    return Response(stacks, media_type="text/plain; charset=utf-8")
+
+
+@app.get("/api/debug/profile/requests")
+async def debug_request_profiles(current_user: User = Depends(require_admin)):
+    return request_profiler.list()
+
+
+@app.get("/api/debug/profile/requests/{profile_id}")
+async def debug_request_profile(profile_id: str, current_user: User = Depends(require_admin)):
+    result = request_profiler.get(profile_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return Response(result["report"], media_type="text/plain; charset=utf-8")
+
+
+@app.get("/api/debug/traces")
+async def debug_traces(current_user: User = Depends(require_admin)):
+    return {**tracer.stats(), "traces": tracer.summaries()}
+
+
+@app.get("/api/debug/traces/{trace_id}")
+async def debug_trace(trace_id: str, format: str = Query("json", pattern="^(json|otlp)$"),
+                      current_user: User = Depends(require_admin)):
+    if format == "otlp":
+        root = tracer.root(trace_id)
+        result = tracer.to_otlp(root) if root else None
+    else:
+        result = tracer.get(trace_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Трасса не найдена")
+    return result
+
+
+@app.get("/api/debug/singleflight")
+async def debug_singleflight(current_user: User = Depends(require_admin)):
+    return single_flight.stats()
+
+
+@app.get("/api/debug/storage")
+async def debug_storage(limit: int = Query(20, ge=1, le=1000), current_user: User = Depends(require_admin)):
+    return storage_stats.stats(limit)
+
+
+@app.get("/api/debug/images")
+async def debug_images(current_user: User = Depends(require_admin)):
+    return image_pipeline.stats()
+
+
+@app.get("/api/debug/uploads")
+async def debug_uploads(current_user: User = Depends(require_admin)):
+    return upload_admission.stats()
+
+
+@app.get("/api/debug/compression")
+async def debug_compression(current_user: User = Depends(require_admin)):
+    return response_compressor.stats()
+
+
+@app.get("/api/debug/auth")
+async def debug_auth(current_user: User = Depends(require_admin)):
+    return {"identityCache": identity_cache.stats(), "lastSeen": last_seen.stats()}
+
+
+@app.get("/api/debug/sessions")
+async def debug_sessions(current_user: User = Depends(require_admin)):
+    return session_service.stats()
+
+
+@app.get("/api/debug/ratelimit")
+async def debug_ratelimit(current_user: User = Depends(require_admin)):
+    return rate_limiter.stats()
+
+
+@app.get("/api/debug/logging")
+async def debug_logging(current_user: User = Depends(require_admin)):
+    return log_pipeline.stats()
+
+
 @app.get("/api/test")
 async def test_endpoint():
-    return JSONResponse({
+    return FastJSONResponse({
         "message": "Test endpoint working",
-        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "timestamp": TimeUtils.now_iso(),
         "server_url": settings.api_base
     })
 
@@ -475,13 +831,26 @@ async def session_ping(payload: dict):
     session_id = payload.get("sessionId")
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
-    
-    # Простая проверка сессии (можно расширить)
+
+    # Только память: активность попадёт в базу при следующей пакетной записи
+    session = await session_service.update_session_activity(session_id)
+    if not session:
+        return {"success": False, "valid": False, "session": None}
     return {
         "success": True,
+        "valid": True,
         "session": {
             "id": session_id,
             "isActive": True,
-            "lastActivity": datetime.utcnow().isoformat() + "Z"
+            "lastActivity": TimeUtils.to_iso(session["lastActivity"]),
+            "expiresAt": TimeUtils.to_iso(session["expiresAt"])
         }
     }
+
+
+@app.post("/api/session/close")
+async def session_close(payload: dict):
+    session_id = payload.get("sessionId")
+    if not session_id:
+        raise HTTPException(status_code=400, detail="Session ID required")
+    return {"success": await session_service.close_session(session_id)}
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import gc
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .settings import settings
+
+# Границы корзин гистограмм в секундах (как у клиентских библиотек Prometheus по умолчанию)
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Корзины для операций хранилища: они короче HTTP-запросов
+STORAGE_BUCKETS: Tuple[float, ...] = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Histogram:
+    """Гистограмма без блокировок: счётчики по корзинам, сумма и количество наблюдений"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, lines: List[str], **labels: str):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**labels, le=_number(bound))} {cumulative}")
+        suffix = _labels(**labels) if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum!r}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+
+
+def _rss_bytes() -> Optional[int]:
+    """Текущий RSS процесса; без /proc — пиковый RSS из getrusage"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux отдаёт килобайты, macOS — байты
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class _StorageOpStats:
+    __slots__ = ("count", "lock_wait", "exec", "rows_scanned", "bytes_read", "bytes_written")
+
+    def __init__(self):
+        self.count = 0
+        self.lock_wait = Histogram(STORAGE_BUCKETS)
+        self.exec = Histogram(STORAGE_BUCKETS)
+        self.rows_scanned = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+
+class StorageStats:
+    """Операции хранилища по (таблица, операция): ожидание блокировки, выполнение, строки и байты"""
+
+    def __init__(self, recent_size: int):
+        self._ops: Dict[Tuple[str, str], _StorageOpStats] = {}
+        # Последние операции: (время, таблица, операция, ожидание с, выполнение с, строки, байты записи)
+        self._recent: Deque[Tuple[float, str, str, float, float, int, int]] = deque(maxlen=recent_size)
+        # Операции, ждущие блокировку базы прямо сейчас
+        self.waiting = 0
+
+    def record(self, table: str, op: str, lock_wait_s: float, exec_s: float,
+               rows_scanned: int, bytes_read: int, bytes_written: int):
+        stats = self._ops.get((table, op))
+        if stats is None:
+            stats = self._ops[(table, op)] = _StorageOpStats()
+        stats.count += 1
+        stats.lock_wait.observe(lock_wait_s)
+        stats.exec.observe(exec_s)
+        stats.rows_scanned += rows_scanned
+        stats.bytes_read += bytes_read
+        stats.bytes_written += bytes_written
+        self._recent.append((time.time(), table, op, lock_wait_s, exec_s, rows_scanned, bytes_written))
+
+    def slowest(self, limit: int) -> List[Dict[str, Any]]:
+        """Самые долгие (ожидание + выполнение) из последних операций"""
+        ranked = sorted(self._recent, key=lambda entry: entry[3] + entry[4], reverse=True)[:limit]
+        return [
+            {
+                "at": int(at * 1000),
+                "table": table,
+                "op": op,
+                "lockWaitMs": round(wait * 1000, 3),
+                "execMs": round(exec_s * 1000, 3),
+                "rowsScanned": rows,
+                "bytesWritten": written,
+            }
+            for at, table, op, wait, exec_s, rows, written in ranked
+        ]
+
+    def stats(self, limit: int = 20) -> Dict[str, Any]:
+        operations = []
+        for (table, op), stats in sorted(self._ops.items()):
+            operations.append({
+                "table": table,
+                "op": op,
+                "count": stats.count,
+                "lockWaitMsAvg": round(stats.lock_wait.sum / stats.count * 1000, 3),
+                "execMsAvg": round(stats.exec.sum / stats.count * 1000, 3),
+                "rowsScanned": stats.rows_scanned,
+                "bytesRead": stats.bytes_read,
+                "bytesWritten": stats.bytes_written,
+            })
+        return {"waiting": self.waiting, "operations": operations, "slowest": self.slowest(limit)}
+
+    def render(self, lines: List[str]):
+        ops = sorted(self._ops.items())
+        lines.append("# HELP pedant_storage_operations_total Операции хранилища по таблице и типу")
+        lines.append("# TYPE pedant_storage_operations_total counter")
+        for (table, op), stats in ops:
+            lines.append(f"pedant_storage_operations_total{_labels(table=table, op=op)} {stats.count}")
+        for name, attr, help_text in (
+            ("pedant_storage_lock_wait_seconds", "lock_wait", "Ожидание блокировки базы"),
+            ("pedant_storage_exec_seconds", "exec", "Выполнение операции под блокировкой"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (table, op), stats in ops:
+                getattr(stats, attr).render(name, lines, table=table, op=op)
+        for name, attr, help_text in (
+            ("pedant_storage_rows_scanned_total", "rows_scanned", "Строки таблицы, прочитанные из файла"),
+            ("pedant_storage_bytes_read_total", "bytes_read", "Байты, прочитанные из файла базы"),
+            ("pedant_storage_bytes_written_total", "bytes_written", "Байты, записанные в файл базы"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (table, op), stats in ops:
+                lines.append(f"{name}{_labels(table=table, op=op)} {getattr(stats, attr)}")
+        lines.append("# HELP pedant_storage_lock_waiters Операции, ожидающие блокировку базы")
+        lines.append("# TYPE pedant_storage_lock_waiters gauge")
+        lines.append(f"pedant_storage_lock_waiters {self.waiting}")
+
+
+class Metrics:
+    """Метрики сервера: запросы по маршрутам, задержки, event loop и процесс; отдаются в формате Prometheus"""
+
+    def __init__(self, loop_lag_interval_s: float):
+        self.loop_lag_interval_s = loop_lag_interval_s
+        # (метод, шаблон маршрута, статус) -> число запросов
+        self._requests: Dict[Tuple[str, str, int], int] = {}
+        # (метод, шаблон маршрута) -> гистограмма длительности
+        self._latency: Dict[Tuple[str, str], Histogram] = {}
+        self.in_flight = 0
+        self.loop_lag = Histogram((0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+        self.loop_lag_last = 0.0
+        self.started_at = time.time()
+
+    def request_started(self):
+        self.in_flight += 1
+
+    def request_finished(self, method: str, route: str, status: int, duration_s: float):
+        self.in_flight -= 1
+        key = (method, route, status)
+        self._requests[key] = self._requests.get(key, 0) + 1
+        histogram = self._latency.get((method, route))
+        if histogram is None:
+            histogram = self._latency[(method, route)] = Histogram()
+        histogram.observe(duration_s)
+
+    async def run_loop_lag_monitor(self):
+        """Задержка event loop: насколько позже запланированного просыпается sleep"""
+        while True:
+            expected = time.perf_counter() + self.loop_lag_interval_s
+            await asyncio.sleep(self.loop_lag_interval_s)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.loop_lag_last = lag
+            self.loop_lag.observe(lag)
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        lines.append("# HELP pedant_http_requests_total Завершённые HTTP-запросы по маршруту и статусу")
+        lines.append("# TYPE pedant_http_requests_total counter")
+        for (method, route, status), count in sorted(self._requests.items()):
+            lines.append(f"pedant_http_requests_total{_labels(method=method, route=route, status=str(status))} {count}")
+
+        lines.append("# HELP pedant_http_request_duration_seconds Длительность HTTP-запросов по маршруту")
+        lines.append("# TYPE pedant_http_request_duration_seconds histogram")
+        for (method, route), histogram in sorted(self._latency.items()):
+            histogram.render("pedant_http_request_duration_seconds", lines, method=method, route=route)
+
+        lines.append("# HELP pedant_http_requests_in_flight Запросы в обработке")
+        lines.append("# TYPE pedant_http_requests_in_flight gauge")
+        lines.append(f"pedant_http_requests_in_flight {self.in_flight}")
+
+        lines.append("# HELP pedant_event_loop_lag_seconds Последняя измеренная задержка event loop")
+        lines.append("# TYPE pedant_event_loop_lag_seconds gauge")
+        lines.append(f"pedant_event_loop_lag_seconds {self.loop_lag_last!r}")
+        lines.append("# HELP pedant_event_loop_lag_histogram_seconds Распределение задержки event loop")
+        lines.append("# TYPE pedant_event_loop_lag_histogram_seconds histogram")
+        self.loop_lag.render("pedant_event_loop_lag_histogram_seconds", lines)
+
+        storage_stats.render(lines)
+
+        rss = _rss_bytes()
+        if rss is not None:
+            lines.append("# HELP process_resident_memory_bytes Резидентная память процесса")
+            lines.append("# TYPE process_resident_memory_bytes gauge")
+            lines.append(f"process_resident_memory_bytes {rss}")
+        lines.append("# HELP process_cpu_seconds_total Процессорное время процесса")
+        lines.append("# TYPE process_cpu_seconds_total counter")
+        lines.append(f"process_cpu_seconds_total {time.process_time()!r}")
+        lines.append("# HELP process_start_time_seconds Время запуска процесса (unix)")
+        lines.append("# TYPE process_start_time_seconds gauge")
+        lines.append(f"process_start_time_seconds {self.started_at!r}")
+
+        gc_stats = gc.get_stats()
+        for name, field, kind, help_text in (
+            ("python_gc_collections_total", "collections", "counter", "Сборки мусора по поколениям"),
+            ("python_gc_objects_collected_total", "collected", "counter", "Собранные объекты по поколениям"),
+            ("python_gc_objects_uncollectable_total", "uncollectable", "counter", "Несобираемые объекты по поколениям"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for generation, stats in enumerate(gc_stats):
+                lines.append(f"{name}{_labels(generation=str(generation))} {stats[field]}")
+        lines.append("# HELP python_gc_generation_count Счётчики поколений GC (выделения/сборки с прошлой сборки)")
+        lines.append("# TYPE python_gc_generation_count gauge")
+        for generation, count in enumerate(gc.get_count()):
+            lines.append(f"python_gc_generation_count{_labels(generation=str(generation))} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Глобальные метрики сервера и хранилища
+storage_stats = StorageStats(settings.storage_recent_ops)
+metrics = Metrics(settings.metrics_loop_lag_interval_s)
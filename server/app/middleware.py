@@ -1,9 +1,25 @@
 from fastapi import Request, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from typing import Optional, Dict, Any
-from .utils import LoggerUtils, ValidationUtils
+import base64
+import binascii
+import json
+import math
+import time
+from .utils import LoggerUtils, ValidationUtils, TimeUtils
 from .services import UserService
+from .models import UserCreate
+from .auth import identity_cache, last_seen, verify_init_data
+from .metrics import metrics
+from .profiling import request_profiler
+from .ratelimit import rate_limiter
+from .tracing import tracer
 from .storage import db
+from .uploads import upload_admission
+from .compression import COMPRESSIBLE_TYPES, choose_encoding, response_compressor
+from .settings import settings
 
 security = HTTPBearer(auto_error=False)
 
@@ -12,34 +28,78 @@ class TelegramAuth:
     def __init__(self, user_service: UserService):
         self.user_service = user_service
 
+    @staticmethod
+    def _credentials(request: Request) -> Optional[str]:
+        """Учётные данные запроса: подписанный initData, а без токена бота в разработке — данные пользователя как есть"""
+        if settings.telegram_bot_token:
+            init_data = request.headers.get("X-Telegram-Init-Data")
+            return f"initData:{init_data}" if init_data else None
+
+        # Неподписанным данным нельзя доверять вне разработки: без токена бота никто не аутентифицирован.
+        # Разработка включается только явно (NODE_ENV=development), по умолчанию node_env — production
+        if settings.node_env != "development":
+            return None
+
+        telegram_user = request.headers.get("X-Telegram-User")
+        if telegram_user:
+            return f"user:{telegram_user}"
+        # Если нет в заголовках, проверяем тело запроса
+        if hasattr(request, '_json') and request._json.get('user'):
+            return f"user:{json.dumps(request._json['user'], sort_keys=True)}"
+        return None
+
+    @staticmethod
+    def _verify(credentials: str):
+        """Данные пользователя и срок, до которого проверку можно не повторять"""
+        kind, _, payload = credentials.partition(":")
+        if kind == "initData":
+            user_data, auth_date = verify_init_data(
+                payload, settings.telegram_bot_token, settings.telegram_init_data_max_age_s
+            )
+            return user_data, auth_date + settings.telegram_init_data_max_age_s * 1000
+        return TelegramAuth._decode_user(payload), TimeUtils.now_ms() + settings.auth_cache_ttl_s * 1000
+
+    @staticmethod
+    def _decode_user(payload: str) -> Dict[str, Any]:
+        """JSON пользователя из X-Telegram-User: клиент шлёт его в base64 (UTF-8), допускается и JSON как есть"""
+        try:
+            return json.loads(payload)
+        except ValueError:
+            pass
+        try:
+            return json.loads(base64.b64decode(payload, validate=True).decode("utf-8"))
+        except (binascii.Error, UnicodeDecodeError) as e:
+            raise ValueError("Некорректный заголовок X-Telegram-User") from e
+
     async def __call__(self, request: Request):
-        """Middleware для аутентификации пользователей Telegram"""
+        """Аутентификация пользователей Telegram: проверенные учётные данные берутся из кеша, без записи в базу"""
+        request.state.user = None
         try:
-            # Получаем данные пользователя из заголовков или тела запроса
-            user_data = None
-            
-            # Проверяем заголовки
-            telegram_user = request.headers.get("X-Telegram-User")
-            if telegram_user:
-                import json
-                user_data = json.loads(telegram_user)
-            
-            # Если нет в заголовках, проверяем тело запроса
-            if not user_data and hasattr(request, '_json'):
-                user_data = request._json.get('user')
-            
-            if user_data:
-                # Валидируем данные пользователя
+            credentials = self._credentials(request)
+            if not credentials:
+                LoggerUtils.log_debug("Пользователь не аутентифицирован")
+                return
+
+            key = identity_cache.key(credentials)
+            user_id = identity_cache.get(key)
+            if user_id is None:
+                # Первая встреча с этими данными: проверка подписи и создание/обновление профиля
+                user_data, expires_at = self._verify(credentials)
                 ValidationUtils.validate_telegram_user(user_data)
-                
-                # Создаем или обновляем пользователя
-                user = await self.user_service.create_or_update_user(user_data)
-                request.state.user = user
-                LoggerUtils.log_success(f"Пользователь аутентифицирован: {user.id}")
+                user = await self.user_service.create_or_update_user(UserCreate(**user_data))
+                identity_cache.put(key, user.id, expires_at)
+                identity_cache.remember_user(user, db.version("users", user.id))
             else:
-                LoggerUtils.log_info("Пользователь не аутентифицирован")
-                request.state.user = None
-                
+                user = identity_cache.cached_user(user_id)
+                if user is None:
+                    version = db.version("users", user_id)
+                    user = await self.user_service.get_user_by_id(user_id)
+                    if user:
+                        identity_cache.remember_user(user, version)
+                last_seen.touch(user_id)
+
+            request.state.user = user
+            LoggerUtils.log_debug("Пользователь аутентифицирован", user.id if user else None)
         except Exception as e:
             LoggerUtils.log_error("Ошибка аутентификации", e)
             request.state.user = None
@@ -62,7 +122,7 @@ class RegistrationCheck:
             LoggerUtils.log_info(f"Пользователь {user.id} не зарегистрирован")
             # Можно добавить логику перенаправления или ограничения доступа
         
-        LoggerUtils.log_success(f"Проверка регистрации пройдена для пользователя {user.id}")
+        LoggerUtils.log_debug("Проверка регистрации пройдена для пользователя", user.id)
 
 
 class RoleCheck:
@@ -82,7 +142,7 @@ class RoleCheck:
                 detail=f"Недостаточно прав. Требуемые роли: {', '.join(self.required_roles)}"
             )
         
-        LoggerUtils.log_success(f"Проверка роли пройдена для пользователя {user.id} с ролью {user.role}")
+        LoggerUtils.log_debug("Проверка роли пройдена для пользователя", (user.id, user.role))
 
 
 class ServicePermissionCheck:
@@ -123,15 +183,21 @@ class ServicePermissionCheck:
                 detail=f"Нет разрешения '{self.required_permission}' для сервиса {service_id}"
             )
         
-        LoggerUtils.log_success(
-            f"Проверка разрешения '{self.required_permission}' пройдена для пользователя {user.id} в сервисе {service_id}"
+        LoggerUtils.log_debug(
+            f"Проверка разрешения '{self.required_permission}' пройдена (пользователь, сервис)", (user.id, service_id)
         )
 
 
+# Аутентификация для зависимостей FastAPI
+telegram_auth = TelegramAuth(UserService())
+
+
 # Функции для использования в зависимостях FastAPI
 async def get_current_user(request: Request) -> Optional[Any]:
-    """Получение текущего пользователя из запроса"""
-    return getattr(request.state, 'user', None)
+    """Получение текущего пользователя из запроса (аутентификация — один раз на запрос)"""
+    if not hasattr(request.state, 'user'):
+        await telegram_auth(request)
+    return request.state.user
 
 
 async def require_authentication(request: Request):
@@ -142,6 +208,45 @@ async def require_authentication(request: Request):
     return user
 
 
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+async def rate_limit(request: Request):
+    """Лимиты запросов: token bucket на пользователя (или IP) и общий лимит параллельных записей"""
+    path = request.url.path
+    if any(path.startswith(prefix) for prefix in settings.rate_limit_exempt):
+        yield
+        return
+
+    route = request.scope.get("route")
+    route_key = f"{request.method} {route.path if route else path}"
+    is_write = request.method in WRITE_METHODS
+    user = await get_current_user(request)
+    client = f"user:{user.id}" if user else f"ip:{request.client.host if request.client else '-'}"
+
+    retry_after = rate_limiter.check(client, route_key, is_write)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Слишком много запросов",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    if not is_write:
+        yield
+        return
+
+    if not await rate_limiter.enter_write(route_key):
+        raise HTTPException(
+            status_code=503,
+            detail="Сервер занят, повторите позже",
+            headers={"Retry-After": str(math.ceil(rate_limiter.write_queue_timeout_s))}
+        )
+    try:
+        yield
+    finally:
+        rate_limiter.leave_write()
+
+
 async def require_admin(request: Request):
     """Требует роль администратора"""
     user = await require_authentication(request)
@@ -165,16 +270,307 @@ async def require_service_owner(request: Request):
     return user
 
 
-# Middleware для логирования запросов
-async def log_requests(request: Request, call_next):
-    """Middleware для логирования входящих запросов"""
-    LoggerUtils.log_request({
-        "method": request.method,
-        "url": str(request.url),
-        "headers": dict(request.headers)
-    })
-    
-    response = await call_next(request)
-    
-    LoggerUtils.log_success(f"Ответ отправлен: {response.status_code}")
-    return response
+# Методы и заголовки CORS: API открыт для любых источников (туннель cloudpub, мини-приложение, админка)
+CORS_ALLOW_METHODS = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
+CORS_MAX_AGE = "86400"
+
+
+class CorsLoggingMiddleware:
+    """ASGI-middleware за один проход: CORS (включая preflight), заголовки ответа, логирование и метрики запросов; тело не буферизуется"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        method = scope["method"]
+        query = scope.get("query_string", b"")
+        url = f"{scope['path']}?{query.decode('latin-1')}" if query else scope["path"]
+
+        metrics.request_started()
+        if method == "OPTIONS":
+            await self._preflight(scope, send)
+            duration = time.perf_counter() - started
+            LoggerUtils.log_access(method, url, 200, duration * 1000)
+            metrics.request_finished(method, "preflight", 200, duration)
+            return
+
+        status = 500
+
+        async def send_with_cors(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["Access-Control-Allow-Origin"] = "*"
+                headers["Access-Control-Allow-Methods"] = CORS_ALLOW_METHODS
+                headers["Access-Control-Allow-Headers"] = "*"
+                headers["Access-Control-Expose-Headers"] = "*"
+                LoggerUtils.log_access(method, url, status, (time.perf_counter() - started) * 1000)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cors)
+        finally:
+            # Метка — шаблон маршрута (scope["route"] после роутинга), а не сырой путь: число серий ограничено
+            route = scope.get("route")
+            metrics.request_finished(
+                method, getattr(route, "path", "unmatched"), status, time.perf_counter() - started
+            )
+
+    @staticmethod
+    async def _preflight(scope: Scope, send: Send):
+        """Ответ на любой OPTIONS без вызова приложения"""
+        requested = Headers(scope=scope).get("access-control-request-headers")
+        body = b'{"message":"OK"}'
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"access-control-allow-origin", b"*"),
+                (b"access-control-allow-methods", CORS_ALLOW_METHODS.encode()),
+                (b"access-control-allow-headers", requested.encode("latin-1") if requested else b"*"),
+                (b"access-control-max-age", CORS_MAX_AGE.encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class UploadAdmissionMiddleware:
+    """ASGI-middleware: допуск загрузок по лимиту байт и предельный размер тела до его разбора"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    @staticmethod
+    def _body_limit(scope: Scope) -> Optional[int]:
+        """Предельный размер тела загрузки; None — запрос не загрузка"""
+        method, path = scope.get("method"), scope.get("path", "")
+        if method == "POST" and path == "/api/orders":
+            return settings.upload_max_request_bytes
+        if method == "PUT" and path.startswith("/api/uploads/sessions/"):
+            return settings.upload_max_bytes
+        return None
+
+    @staticmethod
+    async def _reject(send: Send, status: int, detail: str, headers: Optional[list] = None):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                *(headers or []),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        limit = self._body_limit(scope) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        nbytes = settings.upload_max_bytes
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    nbytes = int(value)
+                except ValueError:
+                    pass
+                break
+
+        # Заявленный размер проверяется до чтения тела: multipart не успевает попасть во временные файлы
+        if nbytes > limit:
+            await self._reject(send, 413, f"Тело запроса больше {limit // (1024 * 1024)} МБ")
+            return
+
+        if not upload_admission.try_reserve(nbytes):
+            await self._reject(
+                send, 503, "Сервер занят загрузками, повторите позже",
+                [(b"retry-after", str(upload_admission.retry_after_s).encode())],
+            )
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            # Без Content-Length (или при неверном) размер проверяется по мере чтения тела
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(
+                        status_code=413, detail=f"Тело запроса больше {limit // (1024 * 1024)} МБ"
+                    )
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send)
+        finally:
+            upload_admission.release(nbytes)
+
+
+class CompressionMiddleware:
+    """ASGI-middleware: сжатие JSON/NDJSON/SSE ответов больше порога; потоковые ответы сжимаются по чанкам"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        headers: Optional[MutableHeaders] = None
+        stream = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, headers, stream, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+                if (
+                    content_type not in COMPRESSIBLE_TYPES
+                    or "content-encoding" in headers
+                    or message["status"] < 200
+                    or message["status"] in (204, 206, 304)
+                ):
+                    passthrough = True
+                    await send(message)
+                    return
+                # Отправку заголовков откладываем до первого чанка тела
+                start = message
+                return
+
+            if message["type"] != "http.response.body":
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is None:
+                if not more_body:
+                    # Тело целиком — сжимаем, если оно не меньше порога
+                    if len(body) < response_compressor.minimum_size:
+                        response_compressor.skip()
+                        passthrough = True
+                        await send(start)
+                        await send(message)
+                        return
+                    etag = headers.get("etag")
+                    cache_key = (scope["path"], scope.get("query_string", b""), etag, encoding) if etag else None
+                    body = await response_compressor.compress_body(body, encoding, cache_key)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                stream = response_compressor.stream(encoding)
+                del headers["Content-Length"]
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                await send(start)
+
+            chunk = response_compressor.compress_chunk(stream, body, final=not more_body)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class RequestProfilingMiddleware:
+    """ASGI-middleware: cProfile запроса с заголовком X-Profile, равным profile_request_token"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        token = request_profiler.token
+        if not token or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = next((value for name, value in scope["headers"] if name == b"x-profile"), None)
+        acquired = request_profiler.acquire() if requested == token.encode() else None
+        if acquired is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id, profile = acquired
+
+        async def send_with_profile_id(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Profile-Id"] = profile_id
+            await send(message)
+
+        # Профиль потока event loop: в него попадают и запросы, выполнявшиеся параллельно с этим
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.disable()
+            request_profiler.release(profile_id, profile, scope["method"], scope["path"], time.perf_counter() - started)
+
+
+class TracingMiddleware:
+    """ASGI-middleware: корневой участок трассы для запросов, попавших в выборку или с X-Trace, равным trace_force_token"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # Принудительная трассировка только с токеном: с экспортом каждая трасса — файл на диске
+        token = tracer.force_token
+        forced = bool(token) and any(
+            name == b"x-trace" and value == token.encode() for name, value in scope["headers"]
+        )
+        started = tracer.start_trace(f"{scope['method']} {scope['path']}", force=forced)
+        if started is None:
+            await self.app(scope, receive, send)
+            return
+
+        root, token = started
+        root.attributes["http.method"] = scope["method"]
+        root.attributes["http.target"] = scope["path"]
+
+        async def send_with_trace_id(message: Message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                MutableHeaders(scope=message)["X-Trace-Id"] = root.trace.trace_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+                root.attributes["http.route"] = route.path
+            tracer.finish_trace(root, token)
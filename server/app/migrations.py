@@ -0,0 +1,47 @@
+from typing import Any, Dict, List, Optional
+
+from .utils import LoggerUtils, TimeUtils
+
+
+# Поля с временными метками по таблицам
+TIMESTAMP_FIELDS: Dict[str, List[str]] = {
+    "users": ["lastSeen", "createdAt", "updatedAt"],
+    "services": ["createdAt", "updatedAt"],
+    "serviceEmployees": ["joinedAt"],
+    "orders": ["created_at", "updated_at"],
+    "hiringQueue": ["scannedAt", "processedAt", "expiresAt", "createdAt", "updatedAt"],
+    "sessions": ["createdAt", "lastActivity"],
+    "hiringActivities": ["timestamp"],
+}
+
+
+def _timestamps_to_epoch_ms(fields: List[str]):
+    def convert(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        changed = {}
+        for field in fields:
+            value = doc.get(field)
+            if value is None or (isinstance(value, int) and not isinstance(value, bool)):
+                continue
+            try:
+                changed[field] = TimeUtils.to_ms(value)
+            except ValueError:
+                LoggerUtils.log_error(f"Не удалось преобразовать {field}={value!r} в документе {doc.get('id')}")
+        return changed or None
+    return convert
+
+
+async def migrate_timestamps_to_epoch_ms(db) -> Dict[str, int]:
+    """Перевод ISO-строк и float-миллисекунд в целые epoch-ms"""
+    migrated = {}
+    for table, fields in TIMESTAMP_FIELDS.items():
+        count = await db.transform(table, _timestamps_to_epoch_ms(fields))
+        if count:
+            migrated[table] = count
+    return migrated
+
+
+async def run_migrations(db):
+    """Запуск миграций данных при старте (идемпотентно)"""
+    migrated = await migrate_timestamps_to_epoch_ms(db)
+    if migrated:
+        LoggerUtils.log_success("Временные метки переведены в epoch-ms", migrated)
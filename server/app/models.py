@@ -1,8 +1,17 @@
-from pydantic import BaseModel, Field, validator
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+from pydantic import BaseModel, Field, validator, BeforeValidator, PlainSerializer
+from typing import Optional, List, Dict, Any, Annotated
 from enum import Enum
 
+from .utils import TimeUtils
+
+
+# Время хранится как epoch-ms (int), в JSON-ответах отдаётся ISO-строкой
+EpochMs = Annotated[
+    int,
+    BeforeValidator(TimeUtils.to_ms),
+    PlainSerializer(TimeUtils.to_iso, return_type=str, when_used="json"),
+]
+
 
 class UserRole(str, Enum):
     ADMIN = "admin"
@@ -52,6 +61,10 @@ class HiringStatus(str, Enum):
     WAITING_FOR_HIRE = "waiting_for_hire"
 
 
+# Срок жизни заявки в очереди найма
+HIRING_TTL_MS = 24 * 60 * 60 * 1000
+
+
 class User(BaseModel):
     id: int
     first_name: Optional[str] = ""
@@ -65,9 +78,9 @@ class User(BaseModel):
     registrationStatus: RegistrationStatus = RegistrationStatus.UNREGISTERED
     organizationName: Optional[str] = ""
     orders: int = 0
-    lastSeen: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
-    createdAt: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
-    updatedAt: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
+    lastSeen: EpochMs = Field(default_factory=TimeUtils.now_ms)
+    createdAt: EpochMs = Field(default_factory=TimeUtils.now_ms)
+    updatedAt: EpochMs = Field(default_factory=TimeUtils.now_ms)
     ownedServices: List[int] = Field(default_factory=list)
     employeeServices: List[int] = Field(default_factory=list)
     activeServiceId: Optional[int] = None
@@ -114,8 +127,8 @@ class Service(BaseModel):
     address: str
     status: ServiceStatus = ServiceStatus.ACTIVE
     ownerId: int
-    createdAt: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
-    updatedAt: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
+    createdAt: EpochMs = Field(default_factory=TimeUtils.now_ms)
+    updatedAt: EpochMs = Field(default_factory=TimeUtils.now_ms)
 
     class Config:
         use_enum_values = True
@@ -129,7 +142,7 @@ class ServiceEmployee(BaseModel):
     permissions: List[str] = Field(default_factory=lambda: ["create_orders", "view_orders"])
     status: EmployeeStatus = EmployeeStatus.ACTIVE
     invitedBy: Optional[int] = None
-    joinedAt: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
+    joinedAt: EpochMs = Field(default_factory=TimeUtils.now_ms)
 
     class Config:
         use_enum_values = True
@@ -140,14 +153,14 @@ class Order(BaseModel):
     serviceId: Optional[int] = None
     orderNumber: str
     localOrderNumber: Optional[int] = None
-    created_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
+    created_at: EpochMs = Field(default_factory=TimeUtils.now_ms)
     photos_count: int = 0
     created_by: str = ""
     created_by_id: Optional[int] = None
     comment: str = ""
     photos: List[Dict[str, Any]] = Field(default_factory=list)
     status: OrderStatus = OrderStatus.ACTIVE
-    updated_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
+    updated_at: EpochMs = Field(default_factory=TimeUtils.now_ms)
 
     class Config:
         use_enum_values = True
@@ -161,20 +174,21 @@ class HiringQueue(BaseModel):
     role: EmployeeRole = EmployeeRole.EMPLOYEE
     status: HiringStatus = HiringStatus.PENDING
     qrData: Optional[Dict[str, Any]] = None
-    scannedAt: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
-    processedAt: Optional[str] = None
-    expiresAt: str = Field(default_factory=lambda: (datetime.utcnow().timestamp() + 24 * 60 * 60) * 1000)
-    createdAt: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
-    updatedAt: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
+    scannedAt: EpochMs = Field(default_factory=TimeUtils.now_ms)
+    processedAt: Optional[EpochMs] = None
+    expiresAt: EpochMs = Field(default_factory=lambda: TimeUtils.now_ms() + HIRING_TTL_MS)
+    createdAt: EpochMs = Field(default_factory=TimeUtils.now_ms)
+    updatedAt: EpochMs = Field(default_factory=TimeUtils.now_ms)
 
     @property
     def isExpired(self) -> bool:
-        return datetime.utcnow().timestamp() > self.expiresAt
+        return TimeUtils.now_ms() > self.expiresAt
 
-    def updateStatus(self, new_status: HiringStatus, processed_at: Optional[str] = None):
+    def updateStatus(self, new_status: HiringStatus, processed_at: Optional[int] = None):
+        now = TimeUtils.now_ms()
         self.status = new_status
-        self.processedAt = processed_at or datetime.utcnow().isoformat() + "Z"
-        self.updatedAt = datetime.utcnow().isoformat() + "Z"
+        self.processedAt = processed_at or now
+        self.updatedAt = now
 
     class Config:
         use_enum_values = True
@@ -241,6 +255,9 @@ class OrderUpdate(BaseModel):
     photos: Optional[List[Dict[str, Any]]] = None
     status: Optional[OrderStatus] = None
 
+    class Config:
+        use_enum_values = True
+
 
 class HiringQueueCreate(BaseModel):
     candidateUserId: int
@@ -253,3 +270,16 @@ class HiringQueueCreate(BaseModel):
 class HiringQueueUpdate(BaseModel):
     status: HiringStatus
     employerUserId: Optional[int] = None
+
+
+class BatchSubRequest(BaseModel):
+    id: Optional[str] = None
+    method: str = "GET"
+    # Путь существующего маршрута, можно с query: "/api/orders?serviceId=1"
+    path: str
+    headers: Dict[str, str] = Field(default_factory=dict)
+    body: Optional[Any] = None
+
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest] = Field(min_length=1)
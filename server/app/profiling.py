@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .settings import settings
+
+
+def _frame_label(code) -> str:
+    # Функция, а не строка: стеки одной функции склеиваются во flamegraph
+    filename = "/".join(Path(code.co_filename).parts[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик: снимки стеков всех потоков раз в интервал, вывод в collapsed-формате"""
+
+    def __init__(self, max_duration_s: float):
+        self.max_duration_s = max_duration_s
+        self._busy = False
+        self.runs = 0
+
+    @property
+    def busy(self) -> bool:
+        return self._busy
+
+    def _sample(self, duration_s: float, interval_s: float) -> Counter:
+        own = threading.get_ident()
+        stacks: Counter = Counter()
+        deadline = time.perf_counter() + duration_s
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval_s)
+        return stacks
+
+    async def profile(self, duration_s: float, interval_s: float) -> Optional[str]:
+        """Семплирование в отдельном потоке; None, если профилирование уже идёт"""
+        if self._busy:
+            return None
+        self._busy = True
+        try:
+            stacks = await asyncio.to_thread(self._sample, min(duration_s, self.max_duration_s), interval_s)
+        finally:
+            self._busy = False
+        self.runs += 1
+        # Строка "поток;внешний кадр;...;внутренний кадр N" — вход для flamegraph.pl и speedscope
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class RequestProfiler:
+    """cProfile отдельных запросов по заголовку; результаты хранятся в памяти для администратора"""
+
+    def __init__(self, token: Optional[str], keep: int):
+        self.token = token
+        self.keep = keep
+        self._active = False
+        # id профиля -> метаданные и отчёт pstats
+        self._results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def acquire(self) -> Optional[Tuple[str, cProfile.Profile]]:
+        """(id, профиль), если ни один запрос сейчас не профилируется (cProfile — один на поток)"""
+        if self._active:
+            return None
+        self._active = True
+        return uuid.uuid4().hex[:12], cProfile.Profile()
+
+    def release(self, profile_id: str, profile: cProfile.Profile, method: str, path: str, duration_s: float):
+        self._active = False
+        report = io.StringIO()
+        stats = pstats.Stats(profile, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(60)
+        self._results[profile_id] = {
+            "id": profile_id,
+            "method": method,
+            "path": path,
+            "durationMs": round(duration_s * 1000, 2),
+            "createdAt": int(time.time() * 1000),
+            "report": report.getvalue(),
+        }
+        while len(self._results) > self.keep:
+            self._results.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        return self._results.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [{key: value for key, value in result.items() if key != "report"} for result in self._results.values()]
+
+
+# Глобальные профилировщики
+sampling_profiler = SamplingProfiler(settings.profile_max_duration_s)
+request_profiler = RequestProfiler(settings.profile_request_token, settings.profile_keep)
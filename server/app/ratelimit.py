@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from .settings import settings
+
+
+class TokenBucketLimiter:
+    """Token bucket на ключ (пользователь или IP): rate токенов в секунду, не больше burst"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # ключ -> (токены, время последнего пополнения), в порядке последнего обращения
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """0, если запрос разрешён; иначе сколько секунд ждать до нужного числа токенов"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= cost
+        self._buckets[key] = (tokens - cost if allowed else tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            # Вытесненный ключ при следующем запросе начнёт с полного bucket
+            self._buckets.popitem(last=False)
+        return 0.0 if allowed else (cost - tokens) / self.rate
+
+
+class RateLimiter:
+    """Лимиты запросов: bucket на клиента, общий лимит параллельных записей и счётчики по маршрутам"""
+
+    def __init__(self, rate: float, burst: float, write_cost: float, costs: Dict[str, float],
+                 write_concurrency: int, write_queue_timeout_s: float):
+        self.buckets = TokenBucketLimiter(rate, burst)
+        self.write_cost = write_cost
+        self.costs = costs
+        self.write_concurrency = write_concurrency
+        self.write_queue_timeout_s = write_queue_timeout_s
+        # Ожидающие записи обслуживаются по очереди (FIFO семафора)
+        self._writes = asyncio.Semaphore(write_concurrency)
+        self._routes: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, route: str, outcome: str):
+        counters = self._routes.get(route)
+        if counters is None:
+            counters = self._routes[route] = {"allowed": 0, "limited": 0, "busy": 0}
+        counters[outcome] += 1
+
+    def check(self, client: str, route: str, is_write: bool) -> float:
+        """Списание токенов за запрос; возвращает Retry-After в секундах или 0"""
+        cost = self.costs.get(route, self.write_cost if is_write else 1.0)
+        retry_after = self.buckets.acquire(client, cost)
+        self._count(route, "limited" if retry_after else "allowed")
+        return retry_after
+
+    async def enter_write(self, route: str) -> bool:
+        """Слот записи; False, если за write_queue_timeout_s место не освободилось"""
+        try:
+            await asyncio.wait_for(self._writes.acquire(), self.write_queue_timeout_s)
+            return True
+        except asyncio.TimeoutError:
+            self._count(route, "busy")
+            return False
+
+    def leave_write(self):
+        self._writes.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.buckets.rate,
+            "burst": self.buckets.burst,
+            "clients": len(self.buckets._buckets),
+            "writeConcurrency": self.write_concurrency,
+            "writesInFlight": self.write_concurrency - self._writes._value,
+            "routes": self._routes,
+        }
+
+
+# Глобальный ограничитель запросов
+rate_limiter = RateLimiter(
+    rate=settings.rate_limit_rps,
+    burst=settings.rate_limit_burst,
+    write_cost=settings.rate_limit_write_cost,
+    costs=settings.rate_limit_costs,
+    write_concurrency=settings.write_concurrency,
+    write_queue_timeout_s=settings.write_queue_timeout_s,
+)
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import functools
+import inspect
+import json
+import os
+from datetime import date, datetime
+from enum import Enum
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import anyio
+from fastapi.datastructures import Default, DefaultPlaceholder
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.types import Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # orjson не установлен — сериализуем стандартным json
+    orjson = None
+
+# Файлы по содержимому не меняются — кешируются клиентом навсегда
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def json_default(obj: Any) -> Any:
+    """Типы, которых нет в JSON: pydantic-модели сериализуются напрямую, без jsonable_encoder"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ через orjson (или json при его отсутствии)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _is_response_type(annotation: Any) -> bool:
+    return inspect.isclass(annotation) and issubclass(annotation, Response)
+
+
+def _needs_fastapi_serialization(endpoint: Callable, response_model: Any) -> bool:
+    """response_model (явный или из аннотации возврата) и внедрённый response: Response обрабатывает только FastAPI"""
+    if not isinstance(response_model, DefaultPlaceholder):
+        return response_model is not None
+    signature = inspect.signature(endpoint, eval_str=True)
+    returns = signature.return_annotation
+    if returns is not inspect.Signature.empty and returns is not None and not _is_response_type(returns):
+        return True
+    return any(_is_response_type(param.annotation) for param in signature.parameters.values())
+
+
+def _wrap_endpoint(endpoint: Callable, status_code: Optional[int]) -> Callable:
+    """Результат обработчика сразу упаковывается в FastJSONResponse, минуя jsonable_encoder"""
+    if not inspect.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        result = await endpoint(*args, **kwargs)
+        if isinstance(result, Response):
+            return result
+        return FastJSONResponse(result, status_code=status_code or 200)
+
+    return wrapper
+
+
+class FastJSONRoute(APIRoute):
+    """Маршрут, отдающий результат обработчика через FastJSONResponse.
+
+    status_code декоратора сохраняется. Маршруты с response_model (в том числе из аннотации возврата)
+    или с параметром response: Response не оборачиваются и сериализуются FastAPI как обычно.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, *, response_model: Any = Default(None),
+                 status_code: Optional[int] = None, **kwargs):
+        if not _needs_fastapi_serialization(endpoint, response_model):
+            endpoint = _wrap_endpoint(endpoint, status_code)
+        super().__init__(path, endpoint, response_model=response_model, status_code=status_code, **kwargs)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Разбор заголовка Range (один диапазон); None — отдать файл целиком"""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # Несколько диапазонов не поддерживаем — по RFC 9110 можно ответить 200
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    if not start_text:
+        suffix = int(end_text)
+        if suffix <= 0:
+            raise ValueError(header)
+        return max(0, size - suffix), size - 1
+    start = int(start_text)
+    end = min(int(end_text), size - 1) if end_text else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 Not Modified, если клиент прислал актуальный ETag"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
+async def conditional_json(request: Request, etag: str, produce: Callable[[], Awaitable[Any]]) -> Response:
+    """Условный GET: при совпадении ETag данные не читаются и не сериализуются"""
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    return FastJSONResponse(await produce(), headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+class FileSliceResponse(Response):
+    """Отдача файла или его диапазона; zero-copy, если сервер поддерживает http.response.zerocopysend"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.length = end - start + 1
+        self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.length <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+        async with await anyio.open_file(self.path, "rb") as file:
+            await file.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # Файл оказался короче ожидаемого — закрываем тело
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _immutable_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+
+def immutable_not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 для неизменяемого файла — без обращения к файлу и базе"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=_immutable_headers(etag))
+    return None
+
+
+def immutable_file_response(request: Request, path: Path, etag: str, media_type: str) -> Response:
+    """Ответ для неизменяемого файла: ETag/If-None-Match, Range/If-Range и долгий кеш"""
+    headers = _immutable_headers(etag)
+    cached = immutable_not_modified(request, etag)
+    if cached is not None:
+        return cached
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return Response(status_code=404)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return FileSliceResponse(path, start, end, 206, headers, media_type)
+    return FileSliceResponse(path, 0, size - 1, 200, headers, media_type)
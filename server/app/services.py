@@ -1,16 +1,24 @@
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import List, Optional, Dict, Any, Tuple
 import asyncio
+from contextlib import asynccontextmanager
 from .storage import db
+from .indexes import order_index, order_search_index
+from .analytics import order_stats
+from .uploads import upload_store
+from .images import image_pipeline
 from .models import (
     User, Service, ServiceEmployee, Order, HiringQueue,
     UserCreate, UserUpdate, ServiceCreate, ServiceUpdate,
     EmployeeCreate, EmployeeUpdate, OrderCreate, OrderUpdate,
-    HiringQueueCreate, HiringQueueUpdate, UserRole, RegistrationStatus
+    HiringQueueCreate, HiringQueueUpdate, UserRole, RegistrationStatus,
+    HIRING_TTL_MS
 )
-from .utils import ValidationUtils, LoggerUtils, OrderNumberService, SessionService
+from .singleflight import single_flight
+from .tracing import traced
+from .utils import ValidationUtils, LoggerUtils, OrderNumberService, SessionService, TimeUtils
 
 
+@traced("service")
 class UserService:
     def __init__(self):
         self.db = db
@@ -28,14 +36,15 @@ class UserService:
         
         if existing_user:
             # Обновляем существующего пользователя
+            now = TimeUtils.now_ms()
             update_data = user_data.dict()
             update_data.update({
                 "role": existing_user.role,
                 "status": existing_user.status,
                 "orders": existing_user.orders,
                 "createdAt": existing_user.createdAt,
-                "updatedAt": datetime.utcnow().isoformat() + "Z",
-                "lastSeen": datetime.utcnow().isoformat() + "Z",
+                "updatedAt": now,
+                "lastSeen": now,
                 "registrationStatus": existing_user.registrationStatus,
                 "organizationName": existing_user.organizationName,
                 "ownedServices": existing_user.ownedServices,
@@ -66,7 +75,7 @@ class UserService:
         
         # Обновляем только переданные поля
         update_dict = update_data.dict(exclude_none=True)
-        update_dict["updatedAt"] = datetime.utcnow().isoformat() + "Z"
+        update_dict["updatedAt"] = TimeUtils.now_ms()
         
         updated_data = {**user_data, **update_dict}
         saved_user = await self.db.upsert("users", updated_data, key_field="id")
@@ -97,6 +106,7 @@ class UserService:
             await self.db.upsert("users", user.dict(), key_field="id")
 
 
+@traced("service")
 class ServiceService:
     def __init__(self, user_service: UserService):
         self.db = db
@@ -106,6 +116,7 @@ class ServiceService:
         services_data = await self.db.list("services")
         return [Service(**service) for service in services_data]
 
+    @single_flight.coalesce("services")
     async def get_service_by_id(self, service_id: int) -> Optional[Service]:
         service_data = await self.db.get_by_id("services", service_id)
         return Service(**service_data) if service_data else None
@@ -124,13 +135,14 @@ class ServiceService:
         if existing_service:
             raise ValueError(f"Сервис с номером {service_data.serviceNumber} уже существует")
 
-        service_id = int(datetime.utcnow().timestamp() * 1000)
+        now = TimeUtils.now_ms()
+        service_id = TimeUtils.unique_ms()
         new_service_data = {
             **service_data.dict(),
             "id": service_id,
             "status": "active",
-            "createdAt": datetime.utcnow().isoformat() + "Z",
-            "updatedAt": datetime.utcnow().isoformat() + "Z"
+            "createdAt": now,
+            "updatedAt": now
         }
         
         saved_service = await self.db.insert("services", new_service_data)
@@ -146,7 +158,7 @@ class ServiceService:
             return None
         
         update_dict = update_data.dict(exclude_none=True)
-        update_dict["updatedAt"] = datetime.utcnow().isoformat() + "Z"
+        update_dict["updatedAt"] = TimeUtils.now_ms()
         
         updated_data = {**service_data, **update_dict}
         saved_service = await self.db.upsert("services", updated_data, key_field="id")
@@ -165,10 +177,11 @@ class ServiceService:
             await self.db.upsert("users", owner.dict(), key_field="id")
         
         # Удаляем сервис
-        await self.db.db.table("services").remove(doc_ids=[service_data["doc_id"]])
+        await self.db.delete("services", service_id)
         return True
 
 
+@traced("service")
 class EmployeeService:
     def __init__(self, user_service: UserService):
         self.db = db
@@ -178,6 +191,7 @@ class EmployeeService:
         employees_data = await self.db.list("serviceEmployees")
         return [ServiceEmployee(**emp) for emp in employees_data]
 
+    @single_flight.coalesce("serviceEmployees")
     async def get_employees_by_service(self, service_id: int) -> List[ServiceEmployee]:
         employees_data = await self.db.find("serviceEmployees", serviceId=service_id)
         return [ServiceEmployee(**emp) for emp in employees_data]
@@ -198,12 +212,13 @@ class EmployeeService:
         if existing_employees:
             return ServiceEmployee(**existing_employees[0])
 
-        employee_id = int(datetime.utcnow().timestamp() * 1000)
+        now = TimeUtils.now_ms()
+        employee_id = TimeUtils.unique_ms()
         new_employee_data = {
             **employee_data.dict(),
             "id": employee_id,
             "status": "active",
-            "joinedAt": datetime.utcnow().isoformat() + "Z"
+            "joinedAt": now
         }
         
         saved_employee = await self.db.insert("serviceEmployees", new_employee_data)
@@ -232,7 +247,7 @@ class EmployeeService:
         await self.user_service.remove_employee_service(employee_data["userId"], employee_data["serviceId"])
         
         # Удаляем сотрудника
-        await self.db.db.table("serviceEmployees").remove(doc_ids=[employee_data["doc_id"]])
+        await self.db.delete("serviceEmployees", employee_id)
         return True
 
     async def has_permission(self, user_id: int, service_id: int, permission: str) -> bool:
@@ -250,46 +265,111 @@ class EmployeeService:
         return permission in employee.permissions
 
 
+@traced("service")
 class OrderService:
     def __init__(self, user_service: UserService, service_service: ServiceService):
         self.db = db
         self.user_service = user_service
         self.service_service = service_service
-
-    async def get_all_orders(self) -> List[Order]:
-        orders_data = await self.db.list("orders")
+        self.index = order_index
+        self.search_index = order_search_index
+        self.stats = order_stats
+        self.photos = upload_store
+        self.images = image_pipeline
+        # Все индексы, которые обновляются при изменении заказов
+        self._indexes = [self.index, self.search_index, self.stats]
+        # id заказа -> [блокировка, число ожидающих]: изменения одного заказа и его ссылок на фото идут по очереди
+        self._order_locks: Dict[int, list] = {}
+
+    @asynccontextmanager
+    async def _order_lock(self, order_id: int):
+        entry = self._order_locks.setdefault(order_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._order_locks[order_id]
+
+    async def _ensure_indexes(self):
+        for index in self._indexes:
+            await index.ensure_loaded(self.db)
+
+    def _index_replace(self, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]):
+        for index in self._indexes:
+            if new is None:
+                index.remove(old)
+            else:
+                index.replace(old, new)
+
+    async def _with_creator_names(self, orders_data: List[Dict[str, Any]]) -> List[Order]:
+        # Имя создателя берём по одному разу на пользователя
+        names: Dict[int, Optional[str]] = {}
         orders = []
-        
         for order_data in orders_data:
             order = Order(**order_data)
-            
-            # Обновляем имя создателя
             if order.created_by_id:
-                user = await self.user_service.get_user_by_id(order.created_by_id)
-                if user:
-                    order.created_by = user.name
-            
+                if order.created_by_id not in names:
+                    user = await self.user_service.get_user_by_id(order.created_by_id)
+                    names[order.created_by_id] = user.name if user else None
+                if names[order.created_by_id]:
+                    order.created_by = names[order.created_by_id]
             orders.append(order)
-        
         return orders
 
+    async def get_all_orders(self) -> List[Order]:
+        await self.index.ensure_loaded(self.db)
+        orders_data, _ = self.index.query()
+        return await self._with_creator_names(orders_data)
+
+    async def query_orders(
+        self,
+        service_id: Optional[int] = None,
+        status: Optional[str] = None,
+        created_by: Optional[int] = None,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[Tuple[int, int]] = None,
+    ) -> Tuple[List[Order], Optional[Tuple[int, int]]]:
+        await self.index.ensure_loaded(self.db)
+        orders_data, next_cursor = self.index.query(
+            service_id=service_id, status=status, created_by=created_by,
+            from_ms=from_ms, to_ms=to_ms, limit=limit, before=cursor
+        )
+        return await self._with_creator_names(orders_data), next_cursor
+
+    async def search_orders(self, service_id: int, query: str, limit: int = 50) -> List[Order]:
+        await self._ensure_indexes()
+        order_ids = self.search_index.search(service_id, query, limit)
+        return await self._with_creator_names([self.index.get(order_id) for order_id in order_ids])
+
+    async def get_service_stats(
+        self,
+        service_id: int,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        group_by: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        await self.stats.ensure_loaded(self.db)
+        return self.stats.query(service_id, from_ms=from_ms, to_ms=to_ms, group_by=group_by)
+
     async def get_order_by_id(self, order_id: int) -> Optional[Order]:
-        order_data = await self.db.get_by_id("orders", order_id)
+        await self.index.ensure_loaded(self.db)
+        order_data = self.index.get(order_id)
         if not order_data:
             return None
         
-        order = Order(**order_data)
-        
-        # Обновляем имя создателя
-        if order.created_by_id:
-            user = await self.user_service.get_user_by_id(order.created_by_id)
-            if user:
-                order.created_by = user.name
-        
-        return order
+        orders = await self._with_creator_names([order_data])
+        return orders[0]
 
     async def create_order(self, order_data: OrderCreate) -> Order:
-        order_id = int(datetime.utcnow().timestamp() * 1000)
+        await self.photos.check_photos(order_data.photos)
+        await self._ensure_indexes()
+        now = TimeUtils.now_ms()
+        order_id = TimeUtils.unique_ms()
         
         # Получаем имя создателя
         user = await self.user_service.get_user_by_id(order_data.created_by_id)
@@ -301,36 +381,92 @@ class OrderService:
             "created_by": created_by,
             "photos_count": len(order_data.photos),
             "status": "active",
-            "created_at": datetime.utcnow().isoformat() + "Z",
-            "updated_at": datetime.utcnow().isoformat() + "Z"
+            "created_at": now,
+            "updated_at": now
         }
         
         saved_order = await self.db.insert("orders", new_order_data)
+        self._index_replace(None, saved_order)
+        await self.photos.acquire(saved_order.get("photos"))
+        self.images.submit(saved_order["id"], saved_order.get("photos"))
         return Order(**saved_order)
 
     async def update_order(self, order_id: int, update_data: OrderUpdate) -> Optional[Order]:
-        order_data = await self.db.get_by_id("orders", order_id)
-        if not order_data:
-            return None
-        
+        await self._ensure_indexes()
         update_dict = update_data.dict(exclude_none=True)
         if "photos" in update_dict:
+            await self.photos.check_photos(update_dict["photos"])
             update_dict["photos_count"] = len(update_dict["photos"])
-        
-        update_dict["updated_at"] = datetime.utcnow().isoformat() + "Z"
-        
-        updated_data = {**order_data, **update_dict}
-        saved_order = await self.db.upsert("orders", updated_data, key_field="id")
+
+        # Старый документ берётся внутри той же атомарной записи: разница фото и индексов считается от него,
+        # а не от чтения, которое могло устареть к моменту записи
+        previous: Dict[str, Any] = {}
+
+        def apply(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            if doc is None:
+                return None
+            previous.update(doc)
+            return {**doc, **update_dict, "updated_at": TimeUtils.now_ms()}
+
+        async with self._order_lock(order_id):
+            saved_order = await self.db.modify("orders", order_id, apply)
+            if saved_order is None:
+                return None
+            self._index_replace(previous, saved_order)
+            if "photos" in update_dict:
+                await self.photos.replace(previous.get("photos"), saved_order.get("photos"))
+        if "photos" in update_dict:
+            self.images.submit(order_id, saved_order.get("photos"))
         return Order(**saved_order)
 
     async def delete_order(self, order_id: int) -> bool:
-        order_data = await self.db.get_by_id("orders", order_id)
-        if not order_data:
-            return False
-        
-        await self.db.db.table("orders").remove(doc_ids=[order_data["doc_id"]])
+        await self._ensure_indexes()
+        async with self._order_lock(order_id):
+            order_data = await self.db.get_by_id("orders", order_id)
+            if not order_data:
+                return False
+
+            await self.db.delete("orders", order_id)
+            self._index_replace(order_data, None)
+            await self.photos.release(order_data.get("photos"))
         return True
 
+    async def import_orders(self, docs: List[Dict[str, Any]]) -> int:
+        """Пакетная запись заказов импорта: одна запись таблицы, индексы и ссылки на фото обновляются"""
+        await self._ensure_indexes()
+        # Повторы id сливаются до чтения старых документов: иначе индексы и ссылки на фото учтут заказ дважды
+        merged: Dict[Any, Dict[str, Any]] = {}
+        for doc in docs:
+            merged[doc["id"]] = {**merged.get(doc["id"], {}), **doc}
+        docs = list(merged.values())
+        old_docs = [self.index.get(doc["id"]) for doc in docs]
+        written = await self.db.bulk_write("orders", upserts=docs)
+        # bulk_write дополняет существующий документ полями импорта
+        new_docs = [{**(old or {}), **doc} for old, doc in zip(old_docs, docs)]
+        for old, new in zip(old_docs, new_docs):
+            self._index_replace(old, new)
+        await self.photos.replace_many(zip(old_docs, new_docs))
+        return written
+
+    async def attach_photo_variants(self, order_id: int, digest: str, variants: Dict[str, Dict[str, Any]]):
+        """Запись готовых превью в метаданные фото заказа"""
+        await self._ensure_indexes()
+        previous: Dict[str, Any] = {}
+
+        def apply(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            if doc is None:
+                return None
+            previous.update(doc)
+            photos = [
+                {**photo, **variants} if photo.get("digest") == digest else photo
+                for photo in doc.get("photos", [])
+            ]
+            return {**doc, "photos": photos}
+
+        saved_order = await self.db.modify("orders", order_id, apply)
+        if saved_order:
+            self._index_replace(previous, saved_order)
+
     async def generate_next_order_number(self, service_number: str) -> str:
         # Находим все заказы для данного сервиса
         orders_data = await self.db.list("orders")
@@ -355,22 +491,24 @@ class OrderService:
         return f"{service_number}-{next_number:05d}"
 
 
+@traced("service")
 class HiringQueueService:
     def __init__(self, user_service: UserService):
         self.db = db
         self.user_service = user_service
 
     async def add_to_queue(self, queue_data: HiringQueueCreate) -> HiringQueue:
-        queue_id = int(datetime.utcnow().timestamp() * 1000)
+        now = TimeUtils.now_ms()
+        queue_id = TimeUtils.unique_ms()
         
         new_queue_data = {
             **queue_data.dict(),
             "id": queue_id,
             "status": "pending",
-            "scannedAt": datetime.utcnow().isoformat() + "Z",
-            "expiresAt": (datetime.utcnow().timestamp() + 24 * 60 * 60) * 1000,
-            "createdAt": datetime.utcnow().isoformat() + "Z",
-            "updatedAt": datetime.utcnow().isoformat() + "Z"
+            "scannedAt": now,
+            "expiresAt": now + HIRING_TTL_MS,
+            "createdAt": now,
+            "updatedAt": now
         }
         
         saved_queue = await self.db.insert("hiringQueue", new_queue_data)
@@ -402,6 +540,7 @@ class HiringQueueService:
         
         return queue
 
+    @single_flight.coalesce("hiringQueue")
     async def get_employer_queue(self, employer_user_id: int) -> List[HiringQueue]:
         queue_data = await self.db.list("hiringQueue")
         queue_items = []
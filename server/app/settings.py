@@ -1,14 +1,108 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List
 
 class Settings(BaseSettings):
-    node_env: str = "development"
+    # Окружение; "development" (неподписанный X-Telegram-User без токена бота) включается только явно
+    node_env: str = "production"
     public_api_base: str = "http://localhost:3001"
 
     CLOUDPUB_SERVER_URL: str | None = None
     CLOUDPUB_CLIENT_URL: str | None = None
     CLOUDPUB_ADMIN_URL: str | None = None
 
+    # Аутентификация Telegram WebApp: с токеном бота принимается только подписанный initData
+    telegram_bot_token: str | None = None
+    telegram_init_data_max_age_s: int = 24 * 60 * 60
+    # Без токена (разработка) доверяем заголовку X-Telegram-User; запись в кеше живёт auth_cache_ttl_s
+    auth_cache_ttl_s: int = 15 * 60
+    auth_cache_size: int = 10000
+    # Накопленные отметки lastSeen пишутся в базу раз в интервал
+    last_seen_flush_interval_s: int = 60
+    # Сессии клиентов живут в памяти; TTL отсчитывается от последней активности, в базу — пачками раз в интервал
+    session_ttl_s: int = 7 * 24 * 60 * 60
+    session_flush_interval_s: int = 30
+
+    # Лимиты запросов на пользователя (без аутентификации — на IP): токенов в секунду и запас
+    rate_limit_rps: float = 20.0
+    rate_limit_burst: float = 100.0
+    # Стоимость запроса в токенах: записи дороже, отдельные тяжёлые маршруты — по "МЕТОД шаблон"
+    rate_limit_write_cost: float = 5.0
+    rate_limit_costs: Dict[str, float] = {"GET /api/orders/next-number/{service_number}": 5.0}
+    # Пути без лимитов (префиксы): раздача фото, проверка здоровья, пинг сессий, метрики;
+    # подзапросы пакета /api/batch лимитируются каждый по своему маршруту
+    rate_limit_exempt: List[str] = ["/uploads/", "/api/health", "/api/session/", "/metrics", "/api/batch"]
+    # Одновременно выполняемые записи на весь сервер; ожидание слота дольше таймаута — 503
+    write_concurrency: int = 8
+    write_queue_timeout_s: float = 2.0
+
+    # Пакетные запросы /api/batch: максимум подзапросов и время на каждый
+    batch_max_requests: int = 20
+    batch_timeout_s: float = 10.0
+
+    # Экспорт/импорт таблиц: документов в пачке и предельная длина строки NDJSON при импорте
+    transfer_batch_size: int = 1000
+    transfer_max_line_bytes: int = 1024 * 1024
+
+    # Загрузка фото заказов
+    upload_dir: str = "data/uploads"
+    upload_max_bytes: int = 15 * 1024 * 1024
+    # Предельный размер тела multipart-запроса создания заказа (все фото и поля вместе)
+    upload_max_request_bytes: int = 100 * 1024 * 1024
+    upload_chunk_size: int = 64 * 1024
+    upload_allowed_types: List[str] = ["image/jpeg", "image/png", "image/webp", "image/heic", "image/heif"]
+    # Сколько фото одного запроса обрабатываются параллельно
+    upload_parallelism: int = 4
+    # Лимит одновременно принимаемых байт загрузок на весь сервер; сверх него — 503 с Retry-After
+    upload_max_inflight_bytes: int = 200 * 1024 * 1024
+    upload_retry_after_s: int = 5
+    # Сборка мусора: неиспользуемые фото удаляются не раньше, чем через upload_gc_grace_s
+    upload_gc_interval_s: int = 60 * 60
+    upload_gc_grace_s: int = 60 * 60
+    # Сессии возобновляемой загрузки без активности удаляются через upload_session_ttl_s
+    upload_session_ttl_s: int = 24 * 60 * 60
+
+    # Превью фото (генерируются в пуле процессов)
+    image_workers: int = 2
+    image_queue_size: int = 1000
+    image_thumbnail_size: int = 320
+    image_preview_size: int = 1280
+
+    # Сжатие JSON-ответов (gzip, br при установленном brotli); тела меньше порога не сжимаются
+    compression_min_size: int = 1024
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 5
+    # Кеш сжатых тел ответов с ETag
+    compression_cache_max_bytes: int = 32 * 1024 * 1024
+
+    # Логирование: JSON-строки (log_format=json) или текст, пишутся фоновым потоком
+    log_level: str = "INFO"
+    log_format: str = "json"
+    # Доля записываемых массовых событий (успешные запросы, отладка) по уровням; ошибки пишутся всегда
+    log_sample_rates: Dict[str, float] = {"DEBUG": 1.0, "INFO": 0.1}
+    log_queue_size: int = 10000
+
+    # Шаг грубых часов TimeUtils.now_ms: метки времени точны до тика, зато не требуют системного вызова
+    clock_resolution_ms: int = 10
+
+    # Метрики /metrics: период замера задержки event loop
+    metrics_loop_lag_interval_s: float = 0.5
+    # Сколько последних операций хранилища держать для /api/debug/storage
+    storage_recent_ops: int = 1000
+
+    # Профилирование: семплирование по запросу администратора не дольше profile_max_duration_s;
+    # cProfile отдельного запроса — по заголовку X-Profile со значением profile_request_token (без токена выключено)
+    profile_max_duration_s: float = 60.0
+    profile_request_token: str | None = None
+    profile_keep: int = 20
+
+    # Трассировка: доля запросов в выборке (плюс запросы с X-Trace, равным trace_force_token; без токена
+    # принудительная трассировка выключена), размер буфера трасс,
+    # каталог для экспорта трасс файлами OTLP/JSON (без него экспорт выключен)
+    trace_sample_rate: float = 0.01
+    trace_force_token: str | None = None
+    trace_buffer_size: int = 200
+    trace_export_dir: str | None = None
+
     @property
     def api_base(self) -> str:
         base_url = self.CLOUDPUB_SERVER_URL or self.public_api_base or "http://localhost:3001"
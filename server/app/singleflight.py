@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from .storage import db
+
+
+class SingleFlight:
+    """Одинаковые одновременные чтения выполняются один раз, остальные вызовы ждут тот же результат"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.executions = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+        # Отмена одного ожидающего (клиент отключился) не отменяет общее выполнение
+        return await asyncio.shield(task)
+
+    def coalesce(self, *tables: str):
+        """Декоратор async-метода сервиса: ключ — метод, аргументы и версии таблиц, из которых он читает.
+
+        Запись в любую из таблиц меняет ключ, поэтому вызов после записи не получит результат,
+        посчитанный до неё. Результат общий для всех ожидающих — его нельзя изменять.
+        """
+
+        def decorate(fn):
+            name = fn.__qualname__
+
+            @functools.wraps(fn)
+            async def coalesced(self_, *args, **kwargs):
+                versions = tuple(db.version(table) for table in tables)
+                key: Tuple = (name, args, tuple(sorted(kwargs.items())), versions)
+                return await self.do(key, lambda: fn(self_, *args, **kwargs))
+
+            return coalesced
+
+        return decorate
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": len(self._inflight), "executions": self.executions, "shared": self.shared}
+
+
+# Глобальное объединение одинаковых чтений
+single_flight = SingleFlight()
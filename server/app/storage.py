@@ -1,59 +1,164 @@
 from __future__ import annotations
 
 import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 from tinydb import TinyDB, Query
+from tinydb.storages import JSONStorage
+
+from .metrics import storage_stats
+from .tracing import tracer
+
+
+class CountingJSONStorage(JSONStorage):
+    """JSONStorage со счётчиками чтений и байт; TinyDB перечитывает весь файл на каждый запрос"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reads = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        # Число строк в таблицах по последнему чтению файла
+        self.table_sizes: Dict[str, int] = {}
+
+    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        data = super().read()
+        self.reads += 1
+        self.bytes_read += os.fstat(self._handle.fileno()).st_size
+        if data is not None:
+            self.table_sizes = {name: len(rows) for name, rows in data.items()}
+        return data
+
+    def write(self, data: Dict[str, Dict[str, Any]]):
+        super().write(data)
+        self.bytes_written += os.fstat(self._handle.fileno()).st_size
 
 
 class AsyncTinyDB:
     def __init__(self, path: str):
         self._path = Path(path)
         self._path.parent.mkdir(parents=True, exist_ok=True)
-        self._db = TinyDB(self._path)
+        self._db = TinyDB(self._path, storage=CountingJSONStorage)
+        self._storage: CountingJSONStorage = self._db.storage
         self._lock = asyncio.Lock()
+        # Версии таблиц и документов для ETag; эпоха отличает версии разных запусков процесса
+        self._epoch = f"{time.time_ns():x}"
+        self._versions: Dict[str, int] = {}
+        self._doc_versions: Dict[Tuple[str, Any], int] = {}
+
+    def _touch(self, table: str, *item_ids: Any):
+        """Увеличивает версию таблицы; изменённые документы получают ту же версию"""
+        version = self._versions.get(table, 0) + 1
+        self._versions[table] = version
+        for item_id in item_ids:
+            if item_id is not None:
+                self._doc_versions[(table, item_id)] = version
+
+    def version(self, table: str, item_id: Any = None) -> int:
+        """Текущая версия таблицы или документа (по id); растёт при каждой записи"""
+        if item_id is None:
+            return self._versions.get(table, 0)
+        return self._doc_versions.get((table, item_id), 0)
+
+    def etag(self, *parts: Union[str, Tuple[str, Any]]) -> str:
+        """Слабый ETag из версий таблиц ("orders") и документов (("orders", id)) без чтения данных"""
+        versions = ".".join(str(self.version(*part) if isinstance(part, tuple) else self.version(part)) for part in parts)
+        return f'W/"{self._epoch}-{versions}"'
+
+    @asynccontextmanager
+    async def _locked(self, table: str, op: str) -> AsyncIterator[None]:
+        """Блокировка базы с замером ожидания, выполнения, прочитанных строк и записанных байт"""
+        storage = self._storage
+        span = tracer.start_span(f"storage.{op}", "storage")
+        requested = time.perf_counter()
+        storage_stats.waiting += 1
+        try:
+            await self._lock.acquire()
+        finally:
+            storage_stats.waiting -= 1
+        acquired = time.perf_counter()
+        reads, bytes_read, bytes_written = storage.reads, storage.bytes_read, storage.bytes_written
+        try:
+            yield
+        finally:
+            finished = time.perf_counter()
+            self._lock.release()
+            rows_scanned = (storage.reads - reads) * storage.table_sizes.get(table, 0)
+            written = storage.bytes_written - bytes_written
+            storage_stats.record(
+                table, op, acquired - requested, finished - acquired,
+                rows_scanned, storage.bytes_read - bytes_read, written,
+            )
+            if span is not None:
+                span.attributes.update({
+                    "db.table": table,
+                    "db.lock_wait_ms": round((acquired - requested) * 1000, 3),
+                    "db.rows_scanned": rows_scanned,
+                    "db.bytes_written": written,
+                })
+                span.end()
+
+    async def scan(self, table: str, batch_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Документы таблицы пачками; файл читается один раз под блокировкой, пачки отдаются уже без неё"""
+        async with self._locked(table, "scan"):
+            rows = iter(self._db.table(table))
+            batch = list(islice(rows, batch_size))
+        while batch:
+            yield batch
+            batch = list(islice(rows, batch_size))
+
+    def tables(self) -> Set[str]:
+        return self._db.tables()
 
     async def list(self, table: str) -> List[Dict[str, Any]]:
-        async with self._lock:
+        async with self._locked(table, "list"):
             return list(self._db.table(table).all())
 
     async def insert(self, table: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        async with self._lock:
-            tbl = self._db.table(table)
-            next_id = 1
-            rows = tbl.all()
-            if rows:
-                next_id = max([r.get("id", 0) for r in rows]) + 1
-            data = {**data, "id": data.get("id", next_id)}
-            tbl.insert(data)
-            return data
+        async with self._locked(table, "insert"):
+            return self._insert(self._db.table(table), data)
+
+    def _insert(self, tbl, data: Dict[str, Any]) -> Dict[str, Any]:
+        next_id = 1
+        rows = tbl.all()
+        if rows:
+            next_id = max([r.get("id", 0) for r in rows]) + 1
+        data = {**data, "id": data.get("id", next_id)}
+        tbl.insert(data)
+        self._touch(tbl.name, data["id"])
+        return data
 
     async def get_by_id(self, table: str, item_id: int) -> Optional[Dict[str, Any]]:
-        async with self._lock:
+        async with self._locked(table, "get_by_id"):
             tbl = self._db.table(table)
             q = Query()
             res = tbl.search(q.id == item_id)
             return res[0] if res else None
 
     async def upsert(self, table: str, data: Dict[str, Any], key_field: str = "id") -> Dict[str, Any]:
-        async with self._lock:
+        async with self._locked(table, "upsert"):
             tbl = self._db.table(table)
             q = Query()
             key_val = data.get(key_field)
             if key_val is None:
-                return await self.insert(table, data)
+                return self._insert(tbl, data)
             existing = tbl.search(getattr(q, key_field) == key_val)
             if existing:
                 doc_id = existing[0].doc_id
                 tbl.update(data, doc_ids=[doc_id])
-                return data
+                self._touch(table, existing[0].get("id"))
             else:
                 tbl.insert(data)
-                return data
+                self._touch(table, data.get("id"))
+            return data
 
     async def find(self, table: str, **kwargs) -> List[Dict[str, Any]]:
-        async with self._lock:
+        async with self._locked(table, "find"):
             tbl = self._db.table(table)
             q = Query()
             query = None
@@ -62,5 +167,94 @@ class AsyncTinyDB:
                 query = qk if query is None else (query & qk)
             return tbl.search(query) if query is not None else tbl.all()
 
+    async def modify(
+        self,
+        table: str,
+        item_id: Any,
+        fn: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]],
+        key_field: str = "id",
+    ) -> Optional[Dict[str, Any]]:
+        """Атомарное чтение-изменение-запись документа; fn возвращает новый документ или None для удаления"""
+        async with self._locked(table, "modify"):
+            tbl = self._db.table(table)
+            q = Query()
+            existing = tbl.search(getattr(q, key_field) == item_id)
+            current = dict(existing[0]) if existing else None
+            updated = fn(current)
+            if updated is None:
+                if existing:
+                    tbl.remove(doc_ids=[existing[0].doc_id])
+            elif existing:
+                tbl.update(updated, doc_ids=[existing[0].doc_id])
+            else:
+                tbl.insert(updated)
+            self._touch(table, (updated or current or {}).get("id"))
+            return updated
+
+    async def delete(self, table: str, item_id: Any, key_field: str = "id") -> bool:
+        async with self._locked(table, "delete"):
+            tbl = self._db.table(table)
+            q = Query()
+            existing = tbl.search(getattr(q, key_field) == item_id)
+            if not existing:
+                return False
+            tbl.remove(doc_ids=[doc.doc_id for doc in existing])
+            self._touch(table, *(doc.get("id") for doc in existing))
+            return True
+
+    async def bulk_write(
+        self,
+        table: str,
+        upserts: Iterable[Dict[str, Any]] = (),
+        deletes: Iterable[Any] = (),
+        key_field: str = "id",
+    ) -> int:
+        """Пакетные upsert и удаление по ключу: не больше трёх записей файла на всю пачку"""
+        async with self._locked(table, "bulk_write"):
+            tbl = self._db.table(table)
+            # Повторы ключа в пачке сливаются по порядку, как последовательные upsert
+            pending: Dict[Any, Dict[str, Any]] = {}
+            for doc in upserts:
+                pending[doc[key_field]] = {**pending.get(doc[key_field], {}), **doc}
+            delete_keys = set(deletes)
+            updates, removals, touched = {}, [], []
+            for doc in tbl.all():
+                key = doc.get(key_field)
+                if key in delete_keys:
+                    removals.append(doc.doc_id)
+                    touched.append(doc.get("id"))
+                elif key in pending:
+                    updates[doc.doc_id] = pending.pop(key)
+                    touched.append(doc.get("id"))
+            if updates:
+                changes = iter(updates.values())
+                tbl.update(lambda doc: doc.update(next(changes)), doc_ids=list(updates))
+            if pending:
+                tbl.insert_multiple(pending.values())
+                touched.extend(doc.get("id") for doc in pending.values())
+            if removals:
+                tbl.remove(doc_ids=removals)
+            if touched:
+                self._touch(table, *touched)
+            return len(touched)
+
+    async def transform(self, table: str, fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> int:
+        """Применяет fn к каждому документу; fn возвращает изменённые поля или None"""
+        async with self._locked(table, "transform"):
+            tbl = self._db.table(table)
+            changes = {}
+            changed_ids = []
+            for doc in tbl.all():
+                fields = fn(dict(doc))
+                if fields:
+                    changes[doc.doc_id] = fields
+                    changed_ids.append(doc.get("id"))
+            if changes:
+                # Одна запись файла на всю таблицу; TinyDB обходит doc_ids в переданном порядке
+                pending = iter(changes.values())
+                tbl.update(lambda doc: doc.update(next(pending)), doc_ids=list(changes))
+                self._touch(table, *changed_ids)
+            return len(changes)
+
 
 db = AsyncTinyDB("data/db.json")
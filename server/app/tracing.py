@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import json
+import random
+import time
+from collections import OrderedDict
+from contextvars import ContextVar, Token
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .settings import settings
+from .utils import LoggerUtils
+
+
+class Span:
+    """Участок трассы: слой (http, controller, service, storage), время в unix-нс, атрибуты"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "layer", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, layer: str, parent_id: Optional[str]):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.layer = layer
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        if not self.trace.finished:
+            self.trace.spans.append(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "spanId": self.span_id,
+            "parentId": self.parent_id,
+            "name": self.name,
+            "layer": self.layer,
+            "startNs": self.start_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "finished")
+
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans: List[Span] = []
+        self.finished = False
+
+
+# Текущий участок трассы запроса; None — запрос не попал в выборку, обёртки только вызывают функцию
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Tracer:
+    """Трассировка запросов: выборка по доле, участки через contextvars, кольцевой буфер готовых трасс"""
+
+    def __init__(self, sample_rate: float, buffer_size: int, export_dir: Optional[str],
+                 force_token: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.force_token = force_token
+        self.buffer_size = buffer_size
+        self.export_dir = Path(export_dir) if export_dir else None
+        # trace_id -> корневой участок, в порядке завершения
+        self._traces: "OrderedDict[str, Span]" = OrderedDict()
+        self.sampled = 0
+        self.exported = 0
+
+    def start_trace(self, name: str, force: bool = False) -> Optional[Tuple[Span, Token]]:
+        """Корневой участок запроса, если запрос попал в выборку (или трассировка запрошена заголовком)"""
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        root = Span(Trace(), name, "http", None)
+        return root, _current_span.set(root)
+
+    def finish_trace(self, root: Span, token: Token):
+        _current_span.reset(token)
+        root.end()
+        trace = root.trace
+        trace.finished = True
+        self.sampled += 1
+        self._traces[trace.trace_id] = root
+        while len(self._traces) > self.buffer_size:
+            self._traces.popitem(last=False)
+        if self.export_dir:
+            asyncio.get_running_loop().run_in_executor(None, self._export, root)
+
+    def start_span(self, name: str, layer: str) -> Optional[Span]:
+        """Дочерний участок текущего; None вне трассируемого запроса. Текущим не становится"""
+        parent = _current_span.get()
+        if parent is None or parent.trace.finished:
+            return None
+        return Span(parent.trace, name, layer, parent.span_id)
+
+    def wrap(self, fn, name: str, layer: str):
+        """Обёртка async-метода: участок на каждый вызов, вложенные вызовы становятся дочерними"""
+
+        @functools.wraps(fn)
+        async def traced_call(*args, **kwargs):
+            span = self.start_span(name, layer)
+            if span is None:
+                return await fn(*args, **kwargs)
+            token = _current_span.set(span)
+            try:
+                return await fn(*args, **kwargs)
+            except BaseException as e:
+                span.error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                _current_span.reset(token)
+                span.end()
+
+        return traced_call
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "traceId": trace_id,
+                "name": root.name,
+                "startedAt": root.start_ns // 1_000_000,
+                "durationMs": round((root.end_ns - root.start_ns) / 1e6, 3),
+                "spans": len(root.trace.spans),
+                "status": root.attributes.get("http.status_code"),
+            }
+            for trace_id, root in reversed(self._traces.items())
+        ]
+
+    def root(self, trace_id: str) -> Optional[Span]:
+        return self._traces.get(trace_id)
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        root = self._traces.get(trace_id)
+        if root is None:
+            return None
+        spans = sorted(root.trace.spans, key=lambda span: span.start_ns)
+        return {"traceId": trace_id, "spans": [span.to_dict() for span in spans]}
+
+    def to_otlp(self, root: Span) -> Dict[str, Any]:
+        """Трасса в формате OTLP/JSON (ExportTraceServiceRequest)"""
+        spans = []
+        for span in root.trace.spans:
+            attributes = {**span.attributes, "layer": span.layer}
+            otlp_span = {
+                "traceId": root.trace.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                # SPAN_KIND_SERVER для корня, SPAN_KIND_INTERNAL для остальных
+                "kind": 2 if span.parent_id is None else 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 0},
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "pedant-server"}}]},
+                "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": spans}],
+            }]
+        }
+
+    def _export(self, root: Span):
+        try:
+            self.export_dir.mkdir(parents=True, exist_ok=True)
+            path = self.export_dir / f"{root.trace.trace_id}.json"
+            path.write_text(json.dumps(self.to_otlp(root), ensure_ascii=False))
+            self.exported += 1
+        except Exception as e:
+            LoggerUtils.log_error("Ошибка экспорта трассы", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sampleRate": self.sample_rate,
+            "buffered": len(self._traces),
+            "sampled": self.sampled,
+            "exported": self.exported,
+            "exportDir": str(self.export_dir) if self.export_dir else None,
+        }
+
+
+# Глобальный трассировщик
+tracer = Tracer(
+    settings.trace_sample_rate, settings.trace_buffer_size, settings.trace_export_dir, settings.trace_force_token
+)
+
+
+def traced(layer: str):
+    """Декоратор класса: публичные async-методы создают участки "<Класс>.<метод>" слоя layer"""
+
+    def decorate(cls):
+        for attr, value in list(vars(cls).items()):
+            if not attr.startswith("_") and inspect.iscoroutinefunction(value):
+                setattr(cls, attr, tracer.wrap(value, f"{cls.__name__}.{attr}", layer))
+        return cls
+
+    return decorate
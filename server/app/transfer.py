@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+
+from .models import HiringQueue, Order, Service, ServiceEmployee, User
+from .responses import dumps
+from .storage import AsyncTinyDB
+from .utils import TimeUtils
+
+# Модели для проверки импортируемых документов; импорт в другие таблицы не поддерживается
+IMPORT_MODELS: Dict[str, Type[BaseModel]] = {
+    "users": User,
+    "services": Service,
+    "serviceEmployees": ServiceEmployee,
+    "orders": Order,
+    "hiringQueue": HiringQueue,
+}
+
+ORDER_CSV_FIELDS = [
+    "id", "orderNumber", "localOrderNumber", "serviceId", "status",
+    "created_by_id", "created_by", "comment", "photos_count", "created_at", "updated_at",
+]
+
+# Ошибок в ответе импорта не больше этого числа, остальные только считаются
+MAX_REPORTED_ERRORS = 100
+
+
+class TableTransfer:
+    """Потоковый экспорт таблиц (NDJSON, заказы — CSV) и импорт NDJSON пачками"""
+
+    def __init__(self, db: AsyncTinyDB, order_service, batch_size: int, max_line_bytes: int):
+        self.db = db
+        self.order_service = order_service
+        self.batch_size = batch_size
+        self.max_line_bytes = max_line_bytes
+
+    async def export_ndjson(self, table: str) -> AsyncIterator[bytes]:
+        """Документ на строку; в памяти — одна пачка сериализованных строк"""
+        async for batch in self.db.scan(table, self.batch_size):
+            yield b"".join(dumps(doc) + b"\n" for doc in batch)
+
+    async def export_orders_csv(self) -> AsyncIterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=ORDER_CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        async for batch in self.db.scan("orders", self.batch_size):
+            for doc in batch:
+                writer.writerow({
+                    **doc,
+                    "photos_count": doc.get("photos_count") or len(doc.get("photos") or []),
+                    "created_at": TimeUtils.to_iso(doc["created_at"]) if doc.get("created_at") else "",
+                    "updated_at": TimeUtils.to_iso(doc["updated_at"]) if doc.get("updated_at") else "",
+                })
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+
+    async def _lines(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        pending = b""
+        async for chunk in chunks:
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line
+            if len(pending) > self.max_line_bytes:
+                raise ValueError(f"Строка длиннее {self.max_line_bytes} байт")
+        if pending:
+            yield pending
+
+    def _validate(self, table: str, line: bytes) -> Dict[str, Any]:
+        doc = json.loads(line)
+        if not isinstance(doc, dict) or doc.get("id") is None:
+            raise ValueError("Ожидается объект с полем id")
+        model = IMPORT_MODELS[table].model_validate(doc)
+        # Поля модели приводятся к формату хранения (время — epoch-ms), остальные поля сохраняются как есть
+        return {**doc, **model.model_dump()}
+
+    async def _check(self, table: str, doc: Dict[str, Any]):
+        # Фото заказа — только файлы, уже опубликованные в хранилище
+        if table == "orders":
+            await self.order_service.photos.check_photos(doc.get("photos"))
+
+    async def _write(self, table: str, batch: List[Dict[str, Any]]):
+        if table == "orders":
+            await self.order_service.import_orders(batch)
+        else:
+            await self.db.bulk_write(table, upserts=batch)
+
+    async def import_ndjson(self, table: str, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Построчная проверка и upsert по id пачками; строки с ошибками пропускаются"""
+        imported, failed = 0, 0
+        errors: List[Dict[str, Any]] = []
+        batch: List[Dict[str, Any]] = []
+        line_no = 0
+        stopped: Optional[str] = None
+        try:
+            async for line in self._lines(chunks):
+                line_no += 1
+                if not line.strip():
+                    continue
+                try:
+                    doc = self._validate(table, line)
+                    await self._check(table, doc)
+                except (ValueError, ValidationError, HTTPException) as e:
+                    failed += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        detail = e.detail if isinstance(e, HTTPException) else str(e)
+                        errors.append({"line": line_no, "error": str(detail)[:500]})
+                    continue
+                batch.append(doc)
+                # Считаются принятые строки: повторы id применяются по порядку, как последовательные upsert
+                imported += 1
+                if len(batch) >= self.batch_size:
+                    await self._write(table, batch)
+                    batch = []
+        except ValueError as e:
+            stopped = str(e)
+        if batch:
+            await self._write(table, batch)
+        return {"table": table, "imported": imported, "failed": failed, "errors": errors, "stopped": stopped}
@@ -0,0 +1,534 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+
+from .settings import settings
+from .storage import db
+from .utils import LoggerUtils, TimeUtils
+
+# Таблица метаданных и счётчиков ссылок на файлы фото
+BLOBS_TABLE = "photoBlobs"
+
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+# Имя файла в хранилище — SHA-256 содержимого
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Определение типа изображения по сигнатуре первых байт"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"heic", b"heix", b"hevc", b"hevx"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1", b"heif"):
+            return "image/heif"
+    return None
+
+
+def sniff_file_type(path: Path) -> Optional[str]:
+    """Тип изображения по сигнатуре файла на диске (выполняется в потоке)"""
+    with open(path, "rb") as file:
+        return sniff_image_type(file.read(16))
+
+
+def _hash_and_write(hasher, out, chunk: bytes):
+    hasher.update(chunk)
+    out.write(chunk)
+
+
+def photo_digests(photos: Optional[Iterable[Dict[str, Any]]]) -> Counter:
+    """Число ссылок на каждый файл из списка фото заказа"""
+    return Counter(photo["digest"] for photo in photos or [] if photo.get("digest"))
+
+
+class UploadStore:
+    """Контентно-адресуемое хранилище фото: каждый файл хранится один раз под своим SHA-256"""
+
+    def __init__(self, root: str, max_bytes: int, chunk_size: int, allowed_types: List[str], grace_s: int):
+        self.db = db
+        self.root = Path(root)
+        self.tmp_dir = self.root / "tmp"
+        self.blobs_dir = self.root / "blobs"
+        self.variants_dir = self.root / "variants"
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.allowed_types = set(allowed_types)
+        self.grace_ms = grace_s * 1000
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        self.variants_dir.mkdir(parents=True, exist_ok=True)
+        # Публикация файла и его удаление сборщиком мусора не должны пересекаться
+        self._blob_lock = asyncio.Lock()
+
+    def path_for(self, digest: str) -> Path:
+        if not DIGEST_RE.match(digest):
+            raise ValueError(f"Некорректный digest: {digest!r}")
+        path = self.blobs_dir / digest[:2] / digest
+        if not path.resolve().is_relative_to(self.blobs_dir.resolve()):
+            raise ValueError(f"Путь вне хранилища фото: {digest!r}")
+        return path
+
+    def variant_path(self, digest: str, variant: str) -> Path:
+        """Путь к уменьшенной копии (превью) файла"""
+        if not DIGEST_RE.match(digest) or not variant.isalnum():
+            raise ValueError(f"Некорректное превью: {digest!r}, {variant!r}")
+        return self.variants_dir / f"{digest}-{variant}.jpg"
+
+    def _unlink_blob(self, digest: str):
+        # Записи с некорректным digest (не из хранилища) удаляются без обращения к файлам
+        if not DIGEST_RE.match(digest):
+            return
+        self.path_for(digest).unlink(missing_ok=True)
+        for path in self.variants_dir.glob(f"{digest}-*"):
+            path.unlink(missing_ok=True)
+
+    async def save(self, upload: UploadFile) -> Dict[str, Any]:
+        """Сохраняет файл, считая хеш и проверяя тип и размер по мере чтения"""
+        tmp_path = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+        hasher = hashlib.sha256()
+        size = 0
+        mimetype = None
+        try:
+            out = await asyncio.to_thread(open, tmp_path, "wb")
+            try:
+                while True:
+                    chunk = await upload.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    if mimetype is None:
+                        mimetype = self.check_type(chunk, upload.filename)
+                    size += len(chunk)
+                    self.check_size(size, upload.filename)
+                    # Хеширование и запись в одном переходе в поток, вне event loop
+                    await asyncio.to_thread(_hash_and_write, hasher, out, chunk)
+            finally:
+                await asyncio.to_thread(out.close)
+            if mimetype is None:
+                raise HTTPException(status_code=400, detail=f"Пустой файл: {upload.filename}")
+
+            digest = hasher.hexdigest()
+            await self._publish(tmp_path, digest, size, mimetype)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        return self._photo_meta(upload.filename, digest, size, mimetype)
+
+    async def save_many(self, uploads: List[UploadFile], parallelism: int) -> List[Dict[str, Any]]:
+        """Параллельное сохранение файлов запроса, не больше parallelism одновременно"""
+        semaphore = asyncio.Semaphore(parallelism)
+
+        async def save_one(upload: UploadFile) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.save(upload)
+
+        return list(await asyncio.gather(*(save_one(upload) for upload in uploads)))
+
+    async def save_file(self, path: Path, filename: Optional[str]) -> Dict[str, Any]:
+        """Публикация уже записанного на диск файла (файл переносится или удаляется)"""
+        hasher = hashlib.sha256()
+        size = 0
+        mimetype = None
+        try:
+            async with aiofiles.open(path, "rb") as src:
+                while True:
+                    chunk = await src.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    if mimetype is None:
+                        mimetype = self.check_type(chunk, filename)
+                    size += len(chunk)
+                    self.check_size(size, filename)
+                    await asyncio.to_thread(hasher.update, chunk)
+            if mimetype is None:
+                raise HTTPException(status_code=400, detail=f"Пустой файл: {filename}")
+
+            digest = hasher.hexdigest()
+            await self._publish(path, digest, size, mimetype)
+        finally:
+            path.unlink(missing_ok=True)
+
+        return self._photo_meta(filename, digest, size, mimetype)
+
+    def check_type(self, head: bytes, filename: Optional[str]) -> str:
+        mimetype = sniff_image_type(head[:16])
+        if mimetype not in self.allowed_types:
+            raise HTTPException(status_code=415, detail=f"Неподдерживаемый тип файла: {filename}")
+        return mimetype
+
+    def check_size(self, size: int, filename: Optional[str]):
+        if size > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Файл {filename} больше {self.max_bytes // (1024 * 1024)} МБ"
+            )
+
+    @staticmethod
+    def _photo_meta(filename: Optional[str], digest: str, size: int, mimetype: str) -> Dict[str, Any]:
+        return {
+            "filename": filename,
+            "digest": digest,
+            "size": size,
+            "mimetype": mimetype,
+            "path": f"/uploads/{digest}"
+        }
+
+    async def _publish(self, tmp_path: Path, digest: str, size: int, mimetype: str):
+        """Переносит файл в хранилище, если такого содержимого ещё нет"""
+        now = TimeUtils.now_ms()
+
+        def touch(doc: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            doc = doc or {"id": digest, "refs": 0, "createdAt": now}
+            return {**doc, "size": size, "mimetype": mimetype, "touchedAt": now}
+
+        async with self._blob_lock:
+            target = self.path_for(digest)
+            if not target.exists():
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, target)
+            await self.db.modify(BLOBS_TABLE, digest, touch)
+
+    async def media_type(self, digest: str) -> str:
+        """Тип файла из photoBlobs; для файлов без записи — по сигнатуре, вне event loop"""
+        blob = await self.db.get_by_id(BLOBS_TABLE, digest)
+        if blob and blob.get("mimetype"):
+            return blob["mimetype"]
+        return await asyncio.to_thread(sniff_file_type, self.path_for(digest)) or "application/octet-stream"
+
+    async def check_photos(self, photos: Optional[Iterable[Dict[str, Any]]]):
+        """Фото заказа могут ссылаться только на файлы, уже опубликованные в хранилище; иначе 422"""
+        for digest in photo_digests(photos):
+            if not isinstance(digest, str) or not DIGEST_RE.match(digest) \
+                    or await self.db.get_by_id(BLOBS_TABLE, digest) is None:
+                raise HTTPException(status_code=422, detail=f"Неизвестный файл фото: {digest}")
+
+    async def _adjust_refs(self, deltas: Counter):
+        for digest, delta in deltas.items():
+            if not delta:
+                continue
+
+            def apply(doc: Optional[Dict[str, Any]], delta=delta, digest=digest) -> Dict[str, Any]:
+                doc = doc or {"id": digest, "refs": 0, "createdAt": TimeUtils.now_ms()}
+                return {**doc, "refs": max(0, doc.get("refs", 0) + delta), "touchedAt": TimeUtils.now_ms()}
+
+            await self.db.modify(BLOBS_TABLE, digest, apply)
+
+    async def acquire(self, photos: Optional[List[Dict[str, Any]]]):
+        """Учёт ссылок заказа на файлы фото"""
+        await self._adjust_refs(photo_digests(photos))
+
+    async def release(self, photos: Optional[List[Dict[str, Any]]]):
+        """Снятие ссылок заказа на файлы фото"""
+        deltas = photo_digests(photos)
+        await self._adjust_refs(Counter({digest: -count for digest, count in deltas.items()}))
+
+    async def replace(self, old_photos: Optional[List[Dict[str, Any]]], new_photos: Optional[List[Dict[str, Any]]]):
+        """Пересчёт ссылок при изменении списка фото заказа"""
+        deltas = photo_digests(new_photos)
+        deltas.subtract(photo_digests(old_photos))
+        await self._adjust_refs(deltas)
+
+    async def replace_many(self, pairs: Iterable[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]):
+        """Пересчёт ссылок для пачки заказов (старый, новый): две записи таблицы вместо записи на каждый файл"""
+        deltas: Counter = Counter()
+        for old, new in pairs:
+            deltas.update(photo_digests((new or {}).get("photos")))
+            deltas.subtract(photo_digests((old or {}).get("photos")))
+        deltas = Counter({digest: delta for digest, delta in deltas.items() if delta})
+        if not deltas:
+            return
+        now = TimeUtils.now_ms()
+        seen = set()
+
+        def apply(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            delta = deltas.get(doc.get("id"))
+            if delta is None:
+                return None
+            seen.add(doc["id"])
+            return {"refs": max(0, doc.get("refs", 0) + delta), "touchedAt": now}
+
+        await self.db.transform(BLOBS_TABLE, apply)
+        missing = [
+            {"id": digest, "refs": max(0, delta), "createdAt": now, "touchedAt": now}
+            for digest, delta in deltas.items() if digest not in seen
+        ]
+        if missing:
+            await self.db.bulk_write(BLOBS_TABLE, upserts=missing)
+
+    async def collect_garbage(self) -> Dict[str, int]:
+        """Удаление файлов без ссылок старше grace-периода и брошенных временных файлов"""
+        deadline = TimeUtils.now_ms() - self.grace_ms
+        removed = {"blobs": 0, "bytes": 0, "orphans": 0, "tmp": 0}
+
+        def expire(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            if doc and doc.get("refs", 0) <= 0 and doc.get("touchedAt", 0) < deadline:
+                return None
+            return doc
+
+        known = set()
+        for blob in await self.db.list(BLOBS_TABLE):
+            known.add(blob["id"])
+            if blob.get("refs", 0) > 0 or blob.get("touchedAt", 0) >= deadline:
+                continue
+            async with self._blob_lock:
+                # Повторная проверка под блокировкой: файл мог получить ссылку
+                if await self.db.modify(BLOBS_TABLE, blob["id"], expire) is None:
+                    self._unlink_blob(blob["id"])
+                    removed["blobs"] += 1
+                    removed["bytes"] += blob.get("size", 0)
+
+        deadline_s = deadline / 1000
+        async with self._blob_lock:
+            for path in self.blobs_dir.glob("*/*"):
+                if path.name not in known and path.stat().st_mtime < deadline_s:
+                    self._unlink_blob(path.name)
+                    removed["orphans"] += 1
+        for path in self.tmp_dir.glob("*.part"):
+            if path.stat().st_mtime < deadline_s:
+                path.unlink(missing_ok=True)
+                removed["tmp"] += 1
+
+        if any(removed.values()):
+            LoggerUtils.log_success("Сборка мусора фото", removed)
+        return removed
+
+    async def run_gc_loop(self, interval_s: int):
+        """Периодическая сборка мусора"""
+        while True:
+            try:
+                await self.collect_garbage()
+            except Exception as e:
+                LoggerUtils.log_error("Ошибка сборки мусора фото", e)
+            await asyncio.sleep(interval_s)
+
+
+class UploadSessionStore:
+    """Возобновляемые загрузки: файл приходит частями по смещениям, части хранятся на диске"""
+
+    def __init__(self, store: UploadStore, ttl_s: int):
+        self.store = store
+        self.dir = store.root / "sessions"
+        self.ttl_s = ttl_s
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _meta_path(self, session_id: str) -> Path:
+        return self.dir / f"{session_id}.json"
+
+    def _part_path(self, session_id: str) -> Path:
+        return self.dir / f"{session_id}.part"
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(session_id, asyncio.Lock())
+
+    @asynccontextmanager
+    async def _session(self, session_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Метаданные сессии под её блокировкой; блокировки неизвестных и удалённых сессий не копятся"""
+        if not SESSION_ID_RE.match(session_id):
+            raise HTTPException(status_code=404, detail="Сессия загрузки не найдена")
+        lock = self._lock(session_id)
+        try:
+            async with lock:
+                yield await self._read_meta(session_id)
+        finally:
+            if not lock.locked() and not self._meta_path(session_id).exists():
+                self._locks.pop(session_id, None)
+
+    async def _write_meta(self, meta: Dict[str, Any]):
+        tmp = self.dir / f"{meta['id']}.json.tmp"
+        async with aiofiles.open(tmp, "w") as out:
+            await out.write(json.dumps(meta))
+        os.replace(tmp, self._meta_path(meta["id"]))
+
+    async def _read_meta(self, session_id: str) -> Dict[str, Any]:
+        if not SESSION_ID_RE.match(session_id):
+            raise HTTPException(status_code=404, detail="Сессия загрузки не найдена")
+        try:
+            async with aiofiles.open(self._meta_path(session_id)) as src:
+                return json.loads(await src.read())
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Сессия загрузки не найдена")
+
+    def _state(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        part = self._part_path(meta["id"])
+        offset = meta["size"] if meta.get("photo") else (part.stat().st_size if part.exists() else 0)
+        return {
+            "id": meta["id"],
+            "filename": meta.get("filename"),
+            "size": meta["size"],
+            "offset": offset,
+            "status": "finalized" if meta.get("photo") else "uploading",
+            "photo": meta.get("photo"),
+            "expiresAt": TimeUtils.to_iso(meta["updatedAt"] + self.ttl_s * 1000),
+        }
+
+    async def create(self, filename: Optional[str], size: int) -> Dict[str, Any]:
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="Размер файла должен быть больше нуля")
+        self.store.check_size(size, filename)
+        now = TimeUtils.now_ms()
+        meta = {"id": uuid.uuid4().hex, "filename": filename, "size": size, "createdAt": now, "updatedAt": now}
+        self._part_path(meta["id"]).touch()
+        await self._write_meta(meta)
+        return self._state(meta)
+
+    async def get(self, session_id: str) -> Dict[str, Any]:
+        return self._state(await self._read_meta(session_id))
+
+    async def append(self, session_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Дописывает часть файла; offset должен совпадать с уже принятым объёмом"""
+        async with self._session(session_id) as meta:
+            if meta.get("photo"):
+                raise HTTPException(status_code=409, detail="Загрузка уже завершена")
+            part = self._part_path(session_id)
+            current = part.stat().st_size if part.exists() else 0
+            if offset != current:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "Неверное смещение", "offset": current}
+                )
+            written = current
+            async with aiofiles.open(part, "ab") as out:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    # Тип файла проверяется при завершении (save_file): первый чанк может быть короче сигнатуры
+                    written += len(chunk)
+                    if written > meta["size"]:
+                        await out.truncate(current)
+                        raise HTTPException(status_code=413, detail="Данных больше заявленного размера")
+                    await out.write(chunk)
+            meta["updatedAt"] = TimeUtils.now_ms()
+            await self._write_meta(meta)
+            return self._state(meta)
+
+    async def finalize(self, session_id: str) -> Dict[str, Any]:
+        """Перенос полностью загруженного файла в хранилище фото; сессия держит ссылку на файл до удаления"""
+        async with self._session(session_id) as meta:
+            if meta.get("photo"):
+                return self._state(meta)
+            part = self._part_path(session_id)
+            received = part.stat().st_size if part.exists() else 0
+            if received != meta["size"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "Файл загружен не полностью", "offset": received}
+                )
+            meta["photo"] = await self.store.save_file(part, meta.get("filename"))
+            # Ссылка не даёт сборщику мусора удалить файл, пока сессия ждёт прикрепления к заказу
+            await self.store.acquire([meta["photo"]])
+            meta["holdsRef"] = True
+            meta["updatedAt"] = TimeUtils.now_ms()
+            await self._write_meta(meta)
+            return self._state(meta)
+
+    async def claim(self, session_ids: List[str]) -> List[Dict[str, Any]]:
+        """Метаданные фото завершённых загрузок для прикрепления к заказу"""
+        photos = []
+        for session_id in session_ids:
+            meta = await self._read_meta(session_id)
+            if not meta.get("photo"):
+                raise HTTPException(status_code=409, detail=f"Загрузка {session_id} не завершена")
+            photos.append(meta["photo"])
+        return photos
+
+    async def close(self, session_ids: List[str]):
+        """Удаление сессий после того, как фото прикреплены к заказу; ссылка сессии на файл снимается"""
+        for session_id in session_ids:
+            try:
+                async with self._session(session_id) as meta:
+                    self._meta_path(session_id).unlink(missing_ok=True)
+                    self._part_path(session_id).unlink(missing_ok=True)
+                    if meta.get("holdsRef"):
+                        await self.store.release([meta["photo"]])
+            except HTTPException:
+                # Сессия уже удалена
+                continue
+
+    async def expire(self) -> int:
+        """Удаление сессий без активности дольше ttl"""
+        deadline = TimeUtils.now_ms() - self.ttl_s * 1000
+        expired = []
+        for meta_path in self.dir.glob("*.json"):
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (OSError, ValueError):
+                continue
+            lock = self._locks.get(meta["id"])
+            if meta.get("updatedAt", 0) < deadline and not (lock and lock.locked()):
+                expired.append(meta["id"])
+        await self.close(expired)
+        if expired:
+            LoggerUtils.log_info(f"Удалено просроченных сессий загрузки: {len(expired)}")
+        return len(expired)
+
+    async def run_expiry_loop(self, interval_s: int):
+        """Периодическое удаление брошенных сессий"""
+        while True:
+            try:
+                await self.expire()
+            except Exception as e:
+                LoggerUtils.log_error("Ошибка очистки сессий загрузки", e)
+            await asyncio.sleep(interval_s)
+
+
+# Глобальное хранилище загрузок
+upload_store = UploadStore(
+    settings.upload_dir,
+    max_bytes=settings.upload_max_bytes,
+    chunk_size=settings.upload_chunk_size,
+    allowed_types=settings.upload_allowed_types,
+    grace_s=settings.upload_gc_grace_s,
+)
+upload_sessions = UploadSessionStore(upload_store, ttl_s=settings.upload_session_ttl_s)
+
+
+class UploadAdmission:
+    """Серверный лимит на суммарный объём одновременно принимаемых загрузок"""
+
+    def __init__(self, max_inflight_bytes: int, retry_after_s: int):
+        self.max_inflight_bytes = max_inflight_bytes
+        self.retry_after_s = retry_after_s
+        self.inflight_bytes = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_reserve(self, nbytes: int) -> bool:
+        # Одиночная загрузка больше лимита допускается, если других нет
+        if self.inflight_bytes and self.inflight_bytes + nbytes > self.max_inflight_bytes:
+            self.rejected += 1
+            return False
+        self.inflight_bytes += nbytes
+        self.admitted += 1
+        return True
+
+    def release(self, nbytes: int):
+        self.inflight_bytes = max(0, self.inflight_bytes - nbytes)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "inflightBytes": self.inflight_bytes,
+            "maxInflightBytes": self.max_inflight_bytes,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+upload_admission = UploadAdmission(settings.upload_max_inflight_bytes, settings.upload_retry_after_s)
@@ -1,10 +1,15 @@
+import asyncio
+import hashlib
 import re
-from typing import Any, Dict, List, Optional
-from datetime import datetime
+import secrets
+import time
+from typing import Any, Dict, List, Optional, Union
+from datetime import datetime, timezone
 import logging
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+from .logs import log_pipeline
+
+# Обработчики настраивает log_pipeline (очередь + фоновый поток записи)
 logger = logging.getLogger(__name__)
 
 
@@ -39,12 +44,89 @@ class ValidationUtils:
             raise ValueError('ID пользователя должен быть числом')
 
 
+class TimeUtils:
+    """Единый источник времени: внутри epoch-ms (int), ISO-строка только при сериализации"""
+
+    # Кеш (секунда, "YYYY-MM-DDTHH:MM:SS") для последней отформатированной секунды
+    _iso_cache = (-1, "")
+    # Грубые часы: значение обновляет run_clock_loop; пока цикл не запущен, now_ms читает системные часы
+    _clock_ms = 0
+    _clock_running = False
+    # Последний выданный unique_ms — идентификаторы строго возрастают даже в пределах одного тика
+    _last_unique_ms = 0
+
+    @staticmethod
+    def now_ms() -> int:
+        """Текущее время в миллисекундах с эпохи (с точностью до тика часов)"""
+        if TimeUtils._clock_running:
+            return TimeUtils._clock_ms
+        return time.time_ns() // 1_000_000
+
+    @staticmethod
+    def unique_ms() -> int:
+        """Строго возрастающая метка epoch-ms для идентификаторов документов"""
+        value = max(TimeUtils.now_ms(), TimeUtils._last_unique_ms + 1)
+        TimeUtils._last_unique_ms = value
+        return value
+
+    @staticmethod
+    async def run_clock_loop(resolution_ms: int):
+        """Обновление грубых часов раз в resolution_ms; при остановке now_ms возвращается к системным часам"""
+        TimeUtils._clock_ms = time.time_ns() // 1_000_000
+        TimeUtils._clock_running = True
+        try:
+            while True:
+                await asyncio.sleep(resolution_ms / 1000)
+                TimeUtils._clock_ms = time.time_ns() // 1_000_000
+        finally:
+            TimeUtils._clock_running = False
+
+    @staticmethod
+    def to_iso(ms: int) -> str:
+        """Форматирование epoch-ms в ISO 8601 (UTC, миллисекунды, суффикс Z)"""
+        second, millis = divmod(int(ms), 1000)
+        cached_second, prefix = TimeUtils._iso_cache
+        if second != cached_second:
+            prefix = datetime.fromtimestamp(second, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+            TimeUtils._iso_cache = (second, prefix)
+        return f"{prefix}.{millis:03d}Z"
+
+    @staticmethod
+    def now_iso() -> str:
+        """Текущее время в ISO 8601"""
+        return TimeUtils.to_iso(TimeUtils.now_ms())
+
+    @staticmethod
+    def to_ms(value: Union[int, float, str, datetime, None]) -> Optional[int]:
+        """Приведение ISO-строки, datetime или числа к epoch-ms"""
+        if value is None or value == "":
+            return None
+        if isinstance(value, bool):
+            raise ValueError("Некорректное значение времени")
+        if isinstance(value, (int, float)):
+            # Значения меньше 1e11 считаем секундами (например, auth_date из Telegram)
+            return int(value * 1000) if abs(value) < 1e11 else int(value)
+        if isinstance(value, datetime):
+            dt = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+            return int(dt.timestamp() * 1000)
+        if isinstance(value, str):
+            text = value.strip()
+            if text.lstrip("-").isdigit():
+                return TimeUtils.to_ms(int(text))
+            if text.endswith("Z"):
+                text = text[:-1] + "+00:00"
+            return TimeUtils.to_ms(datetime.fromisoformat(text))
+        raise ValueError(f"Некорректное значение времени: {value!r}")
+
+
 class LoggerUtils:
+    # Сообщения форматируются лениво (аргументами, а не f-строкой) — в потоке записи и только если запись нужна
+
     @staticmethod
     def log_info(message: str, data: Any = None):
         """Логирование информационных сообщений"""
         if data:
-            logger.info(f"{message}: {data}")
+            logger.info("%s: %s", message, data)
         else:
             logger.info(message)
 
@@ -52,37 +134,53 @@ class LoggerUtils:
     def log_success(message: str, data: Any = None):
         """Логирование успешных операций"""
         if data:
-            logger.info(f"✅ {message}: {data}")
+            logger.info("✅ %s: %s", message, data)
         else:
-            logger.info(f"✅ {message}")
+            logger.info("✅ %s", message)
 
     @staticmethod
     def log_error(message: str, error: Exception = None):
         """Логирование ошибок"""
         if error:
-            logger.error(f"❌ {message}: {error}")
+            logger.error("❌ %s: %s", message, error)
         else:
-            logger.error(f"❌ {message}")
+            logger.error("❌ %s", message)
 
     @staticmethod
     def log_debug(message: str, data: Any = None):
-        """Логирование отладочной информации"""
+        """Логирование отладочной информации (массовые события, с семплированием)"""
+        if not logger.isEnabledFor(logging.DEBUG) or not log_pipeline.sampler.keep(logging.DEBUG):
+            return
         if data:
-            logger.debug(f"🔍 {message}: {data}")
+            logger.debug("🔍 %s: %s", message, data)
         else:
-            logger.debug(f"🔍 {message}")
+            logger.debug("🔍 %s", message)
 
     @staticmethod
     def log_request(request_data: Dict[str, Any]):
         """Логирование входящих запросов"""
-        logger.info(f"📥 {request_data.get('method', 'UNKNOWN')} {request_data.get('url', 'UNKNOWN')}")
+        logger.info("📥 %s %s", request_data.get('method', 'UNKNOWN'), request_data.get('url', 'UNKNOWN'))
+
+    @staticmethod
+    def log_access(method: str, url: str, status: int, duration_ms: float):
+        """Одна запись на запрос; успешные семплируются, ошибки (4xx/5xx) пишутся всегда"""
+        if status >= 400:
+            level = logging.ERROR if status >= 500 else logging.WARNING
+        else:
+            level = logging.INFO
+            if not logger.isEnabledFor(level) or not log_pipeline.sampler.keep(level):
+                return
+        logger.log(
+            level, "📥 %s %s → %s (%.1f мс)", method, url, status, duration_ms,
+            extra={"method": method, "url": url, "status": status, "durationMs": round(duration_ms, 1)}
+        )
 
     @staticmethod
     def log_health_check(request_data: Dict[str, Any]) -> Dict[str, Any]:
         """Логирование проверки здоровья сервера"""
         return {
             "status": "ok",
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": TimeUtils.now_iso(),
             "request": request_data
         }
 
@@ -119,36 +217,128 @@ class CorsUtils:
 
 
 class SessionService:
-    def __init__(self, db):
+    """Сессии в памяти (sha256 токена -> сессия) с TTL; таблица sessions пишется пачками (write-behind)"""
+
+    def __init__(self, db, ttl_s: int = 7 * 24 * 60 * 60):
         self.db = db
+        self.ttl_ms = ttl_s * 1000
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        # Ключи сессий, ещё не записанных в таблицу, и удалённых из памяти
+        self._dirty: set = set()
+        self._deleted: set = set()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        # В памяти и в базе хранится только хеш токена
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _is_expired(self, session: Dict[str, Any], now: int) -> bool:
+        return not session.get("isActive") or (session.get("lastActivity") or 0) + self.ttl_ms <= now
+
+    def _drop(self, key: str):
+        self._sessions.pop(key, None)
+        self._dirty.discard(key)
+        self._deleted.add(key)
+
+    def _public(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        return {**session, "expiresAt": session["lastActivity"] + self.ttl_ms}
+
+    async def load(self):
+        """Загрузка непросроченных сессий из таблицы при старте"""
+        now = TimeUtils.now_ms()
+        for doc in await self.db.list("sessions"):
+            key = doc.get("id")
+            if not isinstance(key, str) or len(key) != 64 or self._is_expired(doc, now):
+                # Просроченные и старые записи с открытым токеном вместо хеша
+                self._deleted.add(key)
+            else:
+                self._sessions[key] = dict(doc)
 
     async def create_session(self, user_id: int, user_agent: str, ip_address: str) -> Dict[str, Any]:
-        """Создание новой сессии"""
-        session_id = f"sess-{user_id}-{int(datetime.utcnow().timestamp())}"
+        """Создание новой сессии; токен возвращается только здесь"""
+        now = TimeUtils.now_ms()
+        token = secrets.token_urlsafe(32)
+        key = self._key(token)
         session_data = {
-            "id": session_id,
+            "id": key,
             "userId": user_id,
             "userAgent": user_agent,
             "ipAddress": ip_address,
             "isActive": True,
-            "createdAt": datetime.utcnow().isoformat() + "Z",
-            "lastActivity": datetime.utcnow().isoformat() + "Z"
+            "createdAt": now,
+            "lastActivity": now
         }
-        
-        await self.db.insert("sessions", session_data)
-        return session_data
-
-    async def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        """Получение сессии по ID"""
-        sessions = await self.db.find("sessions", id=session_id)
-        return sessions[0] if sessions else None
+        self._sessions[key] = session_data
+        self._dirty.add(key)
+        return {**self._public(session_data), "token": token}
+
+    async def get_session(self, token: str) -> Optional[Dict[str, Any]]:
+        """Получение сессии по токену; просроченная удаляется при обращении"""
+        key = self._key(token)
+        session = self._sessions.get(key)
+        if session and self._is_expired(session, TimeUtils.now_ms()):
+            self._drop(key)
+            return None
+        return self._public(session) if session else None
+
+    async def update_session_activity(self, token: str) -> Optional[Dict[str, Any]]:
+        """Обновление времени последней активности сессии (только в памяти)"""
+        key = self._key(token)
+        session = self._sessions.get(key)
+        now = TimeUtils.now_ms()
+        if not session or self._is_expired(session, now):
+            if session:
+                self._drop(key)
+            return None
+        session["lastActivity"] = now
+        self._dirty.add(key)
+        return self._public(session)
+
+    async def close_session(self, token: str) -> bool:
+        key = self._key(token)
+        if key not in self._sessions:
+            return False
+        self._drop(key)
+        return True
+
+    def sweep(self) -> int:
+        """Удаление просроченных сессий из памяти"""
+        now = TimeUtils.now_ms()
+        expired = [key for key, session in self._sessions.items() if self._is_expired(session, now)]
+        for key in expired:
+            self._drop(key)
+        return len(expired)
+
+    async def flush(self) -> int:
+        """Запись накопленных изменений в таблицу sessions одной пачкой"""
+        if not self._dirty and not self._deleted:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        deleted, self._deleted = self._deleted, set()
+        try:
+            return await self.db.bulk_write(
+                "sessions",
+                upserts=[dict(self._sessions[key]) for key in dirty if key in self._sessions],
+                deletes=deleted,
+            )
+        except Exception:
+            # Не потерять изменения: повторим при следующей записи
+            self._dirty |= {key for key in dirty if key in self._sessions}
+            self._deleted |= deleted
+            raise
+
+    async def run_maintenance_loop(self, interval_s: int):
+        """Периодическая очистка просроченных сессий и запись изменений"""
+        while True:
+            await asyncio.sleep(interval_s)
+            try:
+                self.sweep()
+                await self.flush()
+            except Exception as e:
+                LoggerUtils.log_error("Ошибка записи сессий", e)
 
-    async def update_session_activity(self, session_id: str):
-        """Обновление времени последней активности сессии"""
-        session = await self.get_session(session_id)
-        if session:
-            session["lastActivity"] = datetime.utcnow().isoformat() + "Z"
-            await self.db.upsert("sessions", session, key_field="id")
+    def stats(self) -> Dict[str, int]:
+        return {"active": len(self._sessions), "pendingWrites": len(self._dirty), "pendingDeletes": len(self._deleted)}
 
     async def track_hiring_activity(self, user_id: int, activity_type: str, data: Dict[str, Any]):
         """Отслеживание активности найма"""
@@ -156,7 +346,7 @@ class SessionService:
             "userId": user_id,
             "activityType": activity_type,
             "data": data,
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "timestamp": TimeUtils.now_ms()
         }
         await self.db.insert("hiringActivities", activity_data)
 
@@ -0,0 +1,95 @@
+"""Бенчмарк GET /api/orders на 10k заказов: FastJSONResponse против jsonable_encoder + json.
+
+Запуск из каталога server:  python benchmarks/bench_orders.py [--orders 10000] [--repeat 20]
+База создаётся во временном каталоге, рабочие data/ не затрагиваются.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+
+def seed(path: Path, count: int):
+    """Заполнение TinyDB-файла заказами (напрямую, без API)"""
+    now = int(time.time() * 1000)
+    words = ["экран", "замена", "батарея", "корпус", "срочно", "гарантия", "клиент", "стекло"]
+    orders = {}
+    for i in range(1, count + 1):
+        created = now - i * 60_000
+        orders[str(i)] = {
+            "id": created,
+            "serviceId": random.randint(1, 5),
+            "orderNumber": f"{i:06d}",
+            "localOrderNumber": i,
+            "created_at": created,
+            "updated_at": created,
+            "photos_count": 2,
+            "created_by": "",
+            "created_by_id": random.randint(1, 20),
+            "comment": " ".join(random.sample(words, 3)),
+            "photos": [
+                {"filename": f"photo_{i}_{n}.jpg", "digest": f"{i:064x}", "size": 250_000,
+                 "mimetype": "image/jpeg", "path": f"/uploads/{i:064x}"}
+                for n in range(2)
+            ],
+            "status": random.choice(["active", "completed", "cancelled"]),
+        }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"orders": orders}, ensure_ascii=False), encoding="utf-8")
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pedant-bench-")
+    os.chdir(workdir)
+    # Неподписанный X-Telegram-User принимается только в разработке
+    os.environ.setdefault("NODE_ENV", "development")
+    seed(Path("data/db.json"), args.orders)
+
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.testclient import TestClient
+    from starlette.responses import JSONResponse
+
+    from app import responses
+    from app.main import app, orders_controller
+
+    import asyncio
+    orders, _ = asyncio.run(orders_controller.query_orders())
+    print(f"Заказов: {len(orders)}, сериализатор: {'orjson' if responses.orjson else 'json'}")
+
+    old_ms, old_max = timed(lambda: JSONResponse(jsonable_encoder(orders)), args.repeat)
+    new_ms, new_max = timed(lambda: responses.FastJSONResponse(orders), args.repeat)
+    print(f"Сериализация jsonable_encoder + json: p50 {old_ms:.1f} мс, max {old_max:.1f} мс")
+    print(f"Сериализация FastJSONResponse:        p50 {new_ms:.1f} мс, max {new_max:.1f} мс")
+
+    with TestClient(app) as client:
+        client.headers["X-Telegram-User"] = json.dumps({"id": 1, "first_name": "Bench"})
+        client.get("/api/orders")  # прогрев индексов
+        size = len(client.get("/api/orders").content)
+        http_ms, http_max = timed(lambda: client.get("/api/orders"), args.repeat)
+    print(f"GET /api/orders ({size / 1024 / 1024:.1f} МБ): p50 {http_ms:.1f} мс, max {http_max:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
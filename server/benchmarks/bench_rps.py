@@ -0,0 +1,122 @@
+"""Бенчмарк пропускной способности middleware: прежний стек (CORSMiddleware + два @app.middleware("http")
++ OPTIONS-маршрут) против одного CorsLoggingMiddleware.
+
+Запуск из каталога server:  python benchmarks/bench_rps.py [--requests 5000] [--concurrency 50]
+Запросы идут в процессе через ASGI-транспорт httpx, без сети: разница — накладные расходы слоёв.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+
+def build_apps():
+    from fastapi import FastAPI, Request
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.routing import APIRoute
+
+    from app.main import app
+    from app.middleware import CorsLoggingMiddleware
+    from app.responses import FastJSONResponse
+    from app.utils import LoggerUtils
+
+    routes = [route for route in app.router.routes if isinstance(route, APIRoute)]
+
+    before = FastAPI(default_response_class=FastJSONResponse)
+    before.router.routes.extend(routes)
+
+    @before.options("/{full_path:path}")
+    async def options_handler(full_path: str):
+        return FastJSONResponse({"message": "OK"}, headers={
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS, PATCH",
+            "Access-Control-Allow-Headers": "*",
+            "Access-Control-Max-Age": "86400",
+        })
+
+    before.add_middleware(
+        CORSMiddleware, allow_origins=["*"], allow_credentials=False,
+        allow_methods=["*"], allow_headers=["*"], expose_headers=["*"],
+    )
+
+    @before.middleware("http")
+    async def log_requests(request: Request, call_next):
+        LoggerUtils.log_request({"method": request.method, "url": str(request.url), "headers": dict(request.headers)})
+        response = await call_next(request)
+        LoggerUtils.log_success(f"Ответ отправлен: {response.status_code}")
+        return response
+
+    @before.middleware("http")
+    async def add_cors_headers(request: Request, call_next):
+        response = await call_next(request)
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
+        response.headers["Access-Control-Allow-Headers"] = "*"
+        response.headers["Access-Control-Expose-Headers"] = "*"
+        return response
+
+    after = FastAPI(default_response_class=FastJSONResponse)
+    after.router.routes.extend(routes)
+    after.add_middleware(CorsLoggingMiddleware)
+    return before, after
+
+
+async def measure(asgi_app, method: str, path: str, total: int, concurrency: int) -> float:
+    import httpx
+
+    transport = httpx.ASGITransport(app=asgi_app)
+    headers = {
+        "Origin": "https://example.org",
+        "Access-Control-Request-Method": "GET",
+        "X-Telegram-User": json.dumps({"id": 1, "first_name": "Bench"}),
+    }
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        remaining = 100
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                response = await client.request(method, path, headers=headers)
+                assert response.status_code == 200, response.status_code
+
+        await worker()  # прогрев
+        remaining = total
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="pedant-bench-"))
+    # Бенчмарк меряет накладные расходы слоёв, а не лимит запросов одного клиента
+    os.environ.setdefault("RATE_LIMIT_RPS", "1e9")
+    os.environ.setdefault("RATE_LIMIT_BURST", "1e9")
+    # Неподписанный X-Telegram-User принимается только в разработке
+    os.environ.setdefault("NODE_ENV", "development")
+    # Логи пишутся, как в работе, но в /dev/null — чтобы вывод не мешал замеру
+    logging.basicConfig(stream=open(os.devnull, "w"), level=logging.INFO, force=True)
+    before, after = build_apps()
+
+    for method, path in [("GET", "/api/health"), ("GET", "/api/orders"), ("OPTIONS", "/api/orders")]:
+        rps_before = asyncio.run(measure(before, method, path, args.requests, args.concurrency))
+        rps_after = asyncio.run(measure(after, method, path, args.requests, args.concurrency))
+        print(f"{method:7} {path:14} до: {rps_before:8.0f} rps   после: {rps_after:8.0f} rps   "
+              f"({rps_after / rps_before:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Нагрузочный тест лимитов: один клиент без пауз долбит /api/orders и /api/orders/next-number,
+обычные клиенты ходят с умеренной частотой. Проверяется, что 429 получает только агрессивный клиент,
+а задержки обычных не растут.
+
+Запуск из каталога server:  python benchmarks/load_ratelimit.py [--seconds 10] [--clients 5]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+
+def user_headers(user_id: int) -> dict:
+    return {"X-Telegram-User": json.dumps({"id": user_id, "first_name": f"User {user_id}"})}
+
+
+async def run_client(client, user_id: int, paths, interval_s: float, deadline: float):
+    statuses, latencies = Counter(), []
+    headers = user_headers(user_id)
+    turn = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get(paths[turn % len(paths)], headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[response.status_code] += 1
+        turn += 1
+        await asyncio.sleep(interval_s)
+    return statuses, latencies
+
+
+async def main_async(args):
+    import httpx
+
+    from app.main import app
+    from app.ratelimit import rate_limiter
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+        deadline = time.perf_counter() + args.seconds
+        hammer_paths = ["/api/orders", "/api/orders/next-number/100"]
+        tasks = [run_client(client, 1, hammer_paths, 0, deadline)]
+        tasks += [
+            run_client(client, 100 + n, ["/api/orders"], args.interval, deadline)
+            for n in range(args.clients)
+        ]
+        results = await asyncio.gather(*tasks)
+
+    for n, (statuses, latencies) in enumerate(results):
+        name = "агрессивный" if n == 0 else f"обычный #{n}"
+        p50 = statistics.median(latencies)
+        p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1]
+        print(f"{name:12} запросов {sum(statuses.values()):6}  статусы {dict(statuses)}  "
+              f"p50 {p50:.1f} мс  p95 {p95:.1f} мс")
+    print("Счётчики по маршрутам:", json.dumps(rate_limiter.stats()["routes"], ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.2, help="пауза обычного клиента между запросами")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="pedant-load-"))
+    # Неподписанный X-Telegram-User принимается только в разработке
+    os.environ.setdefault("NODE_ENV", "development")
+    logging.basicConfig(stream=open(os.devnull, "w"), level=logging.INFO, force=True)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,3 @@
 $env:PYTHONUNBUFFERED = "1"
+$env:NODE_ENV = "development"
 uvicorn app.main:app --reload --port 3001